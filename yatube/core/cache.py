@@ -0,0 +1,370 @@
+import pickle
+import random
+import sqlite3
+import threading
+import time
+import zlib
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.functional import cached_property
+
+from . import metrics
+from .utils import LRUCache
+
+_MISSING = object()
+
+
+def _new_stamp():
+    # Случайное начало: отметка, созданная заново после вытеснения
+    # или очистки, не совпадёт с прежней.
+    return random.getrandbits(62)
+
+
+class SQLiteCache(BaseCache):
+    """Кеш в отдельном файле SQLite, общий для всех процессов на машине.
+
+    Целые числа хранятся как есть, поэтому incr выполняется одним
+    атомарным UPDATE; остальные значения сериализуются pickle.
+    """
+
+    cull_every = 100
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.path = location
+        self._local = threading.local()
+        self._writes = 0
+
+    @property
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None,
+                check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value BLOB, expires REAL)')
+            self._local.db = db
+        return db
+
+    @staticmethod
+    def _dump(value):
+        if type(value) is int:
+            return value
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _load(raw):
+        if isinstance(raw, int):
+            return raw
+        return pickle.loads(raw)
+
+    def _expires(self, timeout):
+        # get_backend_timeout уже возвращает момент истечения.
+        return self.get_backend_timeout(timeout)
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _alive(self):
+        return '(expires IS NULL OR expires > ?)'
+
+    def get(self, key, default=None, version=None):
+        row = self._db.execute(
+            f'SELECT value FROM cache WHERE key = ? AND {self._alive()}',
+            (self._key(key, version), time.time())).fetchone()
+        return default if row is None else self._load(row[0])
+
+    def get_many(self, keys, version=None):
+        names = {self._key(key, version): key for key in keys}
+        if not names:
+            return {}
+        marks = ', '.join('?' * len(names))
+        rows = self._db.execute(
+            f'SELECT key, value FROM cache '
+            f'WHERE key IN ({marks}) AND {self._alive()}',
+            (*names, time.time()))
+        return {names[name]: self._load(raw) for name, raw in rows}
+
+    def _write(self, rows):
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany(
+                'INSERT OR REPLACE INTO cache (key, value, expires) '
+                'VALUES (?, ?, ?)', rows)
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        self._writes += 1
+        if self._writes % self.cull_every == 0:
+            self._cull()
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._write([(
+            self._key(key, version), self._dump(value),
+            self._expires(timeout))])
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self._expires(timeout)
+        self._write([
+            (self._key(key, version), self._dump(value), expires)
+            for key, value in data.items()
+        ])
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute(
+                f'DELETE FROM cache WHERE key = ? AND NOT {self._alive()}',
+                (self._key(key, version), time.time()))
+            added = db.execute(
+                'INSERT OR IGNORE INTO cache (key, value, expires) '
+                'VALUES (?, ?, ?)',
+                (self._key(key, version), self._dump(value),
+                 self._expires(timeout))).rowcount
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        return bool(added)
+
+    def incr(self, key, delta=1, version=None):
+        name = self._key(key, version)
+        db = self._db
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute(
+                f'UPDATE cache SET value = value + ? WHERE key = ? '
+                f"AND typeof(value) = 'integer' AND {self._alive()}",
+                (delta, name, now))
+            row = db.execute(
+                f'SELECT value FROM cache WHERE key = ? '
+                f"AND typeof(value) = 'integer' AND {self._alive()}",
+                (name, now)).fetchone()
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        if row is None:
+            raise ValueError(f"Key '{key}' not found")
+        return row[0]
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return bool(self._db.execute(
+            f'UPDATE cache SET expires = ? WHERE key = ? AND {self._alive()}',
+            (self._expires(timeout), self._key(key, version),
+             time.time())).rowcount)
+
+    def delete(self, key, version=None):
+        self._db.execute(
+            'DELETE FROM cache WHERE key = ?', (self._key(key, version),))
+
+    def delete_many(self, keys, version=None):
+        names = [self._key(key, version) for key in keys]
+        if names:
+            marks = ', '.join('?' * len(names))
+            self._db.execute(
+                f'DELETE FROM cache WHERE key IN ({marks})', names)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version) is not _MISSING
+
+    def clear(self):
+        self._db.execute('DELETE FROM cache')
+
+    def _cull(self):
+        """Удаляет истёкшие записи, а при переполнении - 1/cull_frequency
+        записей, которые истекут раньше других."""
+        db = self._db
+        db.execute(
+            'DELETE FROM cache WHERE expires <= ?', (time.time(),))
+        count = db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count > self._max_entries and self._cull_frequency:
+            db.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                'ORDER BY expires IS NULL, expires LIMIT ?)',
+                (count // self._cull_frequency,))
+
+    def close(self, **kwargs):
+        # Соединение живёт весь поток, как постоянное соединение с БД.
+        pass
+
+
+class TwoTierCache(BaseCache):
+    """Небольшой LRU в памяти процесса поверх общего кеша (L2).
+
+    Записи L1 живут не дольше L1_TIMEOUT. Чтобы изменение из одного
+    процесса не ждало истечения L1 в других, ключи разбиты на
+    STAMP_BUCKETS корзин: каждая запись в L2 меняет отметку версии
+    своей корзины, а процесс перечитывает все отметки одним запросом
+    не чаще раза в STAMP_INTERVAL секунд и не верит записям L1 с
+    устаревшей отметкой. LOCATION - псевдоним кеша L2 в CACHES.
+    """
+
+    stamp_key = 'two_tier_stamp:{}'
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.l2_alias = location
+        self.l1_timeout = options.get('L1_TIMEOUT', 30)
+        self.stamp_interval = options.get('STAMP_INTERVAL', 1)
+        self.buckets = options.get('STAMP_BUCKETS', 64)
+        self._l1 = LRUCache(options.get('L1_MAX_ENTRIES', 1000))
+        self._lock = threading.Lock()
+        self._stamps = {}
+        self._stamps_read = 0
+        self._stats = {'l1_hits': 0, 'l2_hits': 0, 'misses': 0}
+
+    @cached_property
+    def l2(self):
+        return caches[self.l2_alias]
+
+    def stats(self):
+        """Счётчики попаданий этого процесса: l1_hits, l2_hits, misses."""
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, name, amount=1):
+        if amount:
+            with self._lock:
+                self._stats[name] += amount
+            metrics.inc('yatube_cache_tier_total', amount, result=name)
+
+    def _bucket(self, name):
+        # crc32, а не hash(): номер корзины должен совпадать у процессов.
+        return zlib.crc32(name.encode()) % self.buckets
+
+    def _read_stamps(self):
+        now = time.monotonic()
+        if now - self._stamps_read < self.stamp_interval:
+            return
+        keys = [self.stamp_key.format(n) for n in range(self.buckets)]
+        stamps = self.l2.get_many(keys)
+        for key in keys:
+            if key not in stamps:
+                self.l2.add(key, _new_stamp(), None)
+                stamps[key] = self.l2.get(key)
+        with self._lock:
+            self._stamps = {
+                n: stamps[key] for n, key in enumerate(keys)}
+            self._stamps_read = now
+
+    def _bump(self, names):
+        for bucket in {self._bucket(name) for name in names}:
+            key = self.stamp_key.format(bucket)
+            try:
+                stamp = self.l2.incr(key)
+            except ValueError:
+                stamp = _new_stamp()
+                self.l2.set(key, stamp, None)
+            with self._lock:
+                self._stamps[bucket] = stamp
+
+    def _l1_get(self, name):
+        entry = self._l1.get(name)
+        if entry is None:
+            return _MISSING
+        raw, expires, stamp = entry
+        if expires < time.monotonic() or stamp != self._stamps.get(
+                self._bucket(name)):
+            self._l1.delete(name)
+            return _MISSING
+        return pickle.loads(raw)
+
+    def _l1_set(self, name, value, timeout=DEFAULT_TIMEOUT):
+        expires = self.get_backend_timeout(timeout)
+        ttl = self.l1_timeout if expires is None else min(
+            expires - time.time(), self.l1_timeout)
+        stamp = self._stamps.get(self._bucket(name))
+        if ttl <= 0 or stamp is None:
+            return
+        self._l1.set(name, (
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+            time.monotonic() + ttl, stamp))
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        self._read_stamps()
+        found, missing = {}, []
+        for key in keys:
+            value = self._l1_get(self.make_key(key, version))
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        self._count('l1_hits', len(found))
+        if missing:
+            loaded = self.l2.get_many(missing, version=version)
+            for key, value in loaded.items():
+                self._l1_set(self.make_key(key, version), value)
+            self._count('l2_hits', len(loaded))
+            self._count('misses', len(missing) - len(loaded))
+            found.update(loaded)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set_many(data, timeout, version)
+        names = {self.make_key(key, version): value
+                 for key, value in data.items()}
+        self._bump(names)
+        for name, value in names.items():
+            self._l1_set(name, value, timeout)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.l2.add(key, value, timeout, version)
+        if added:
+            name = self.make_key(key, version)
+            self._bump([name])
+            self._l1_set(name, value, timeout)
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        value = self.l2.incr(key, delta, version)
+        name = self.make_key(key, version)
+        self._bump([name])
+        self._l1.delete(name)
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.l2.delete_many(keys, version)
+        names = [self.make_key(key, version) for key in keys]
+        self._bump(names)
+        for name in names:
+            self._l1.delete(name)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version) is not _MISSING
+
+    def clear(self):
+        self.l2.clear()
+        self._l1.clear()
+        with self._lock:
+            self._stamps_read = 0
+
+    def close(self, **kwargs):
+        self.l2.close(**kwargs)
@@ -0,0 +1,115 @@
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.utils import ConnectionDoesNotExist
+
+PIN_COOKIE = 'pin_primary'
+
+_state = threading.local()
+# Реплики, к которым не удалось подключиться: псевдоним -> время,
+# до которого к ним не обращаемся.
+_down_until = {}
+
+
+def reading_from_replica():
+    """Идёт ли сейчас чтение с реплики (в потоке текущего запроса)."""
+    return getattr(_state, 'replica', None) is not None
+
+
+@contextmanager
+def replica_reads():
+    """Чтения внутри блока идут на одну из доступных реплик."""
+    previous = getattr(_state, 'replica', None)
+    _state.replica = choose_replica()
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+def _available(alias):
+    connection = connections[alias]
+    name = connection.settings_dict['NAME']
+    if connection.vendor == 'sqlite' and not os.path.exists(name):
+        # sqlite3 молча создал бы пустую базу вместо реплики.
+        return False
+    try:
+        connection.ensure_connection()
+    except DatabaseError:
+        return False
+    return True
+
+
+def choose_replica():
+    """Случайная доступная реплика или None, если читать надо с primary.
+
+    Недоступная реплика пропускается на REPLICA_RETRY_SECONDS.
+    """
+    now = time.monotonic()
+    replicas = [alias for alias in settings.DATABASE_REPLICAS
+                if _down_until.get(alias, 0) <= now]
+    random.shuffle(replicas)
+    for alias in replicas:
+        try:
+            if _available(alias):
+                return alias
+        except ConnectionDoesNotExist:
+            pass
+        _down_until[alias] = now + settings.REPLICA_RETRY_SECONDS
+    return None
+
+
+def is_pinned(request):
+    return PIN_COOKIE in request.COOKIES
+
+
+def read_from_replica(view):
+    """Отправляет чтения view на реплику, если пользователь недавно
+    ничего не записывал."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.DATABASE_REPLICAS or is_pinned(request):
+            return view(request, *args, **kwargs)
+        # Сессия и пользователь читаются с primary: на отстающей реплике
+        # свежего входа ещё может не быть.
+        request.user.is_authenticated
+        with replica_reads():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+def pin_to_primary(view):
+    """После записи читает пользователя с primary REPLICA_PIN_SECONDS,
+    пока реплики не догонят."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if settings.DATABASE_REPLICAS:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True, samesite='Lax')
+        return response
+    return wrapper
+
+
+class ReplicaRouter:
+    """Чтения из блока replica_reads идут на реплику, остальное - на
+    default. Реплики - копии default, миграции на них не применяются."""
+
+    def db_for_read(self, model, **hints):
+        return getattr(_state, 'replica', None) or 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
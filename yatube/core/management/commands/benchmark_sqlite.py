@@ -0,0 +1,186 @@
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from posts.models import Comment, Post
+
+User = get_user_model()
+
+PROFILES = {
+    'default': ({}, 0),
+    'production': (settings.SQLITE_PRODUCTION_PRAGMAS, 600),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность ленты и комментариев при '
+        'одновременных чтениях и записях: SQLite с настройками по '
+        'умолчанию против production-профиля. Работает на временной '
+        'копии базы.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument(
+            '--seconds', type=float, default=5,
+            help='Длительность прогона каждого профиля.')
+        parser.add_argument('--posts', type=int, default=500)
+        parser.add_argument(
+            '--write-ratio', type=float, default=0.2,
+            help='Доля запросов add_comment среди всех запросов.')
+
+    def handle(self, *args, **options):
+        database = connections.databases['default']
+        saved = database['NAME'], database.get('CONN_MAX_AGE', 0)
+        directory = tempfile.mkdtemp()
+        try:
+            with override_settings(
+                    DEBUG=False, DATABASE_REPLICAS=[], SQLITE_PRAGMAS={},
+                    METRICS_PATH=':memory:',
+                    CACHES={'default': {'BACKEND': (
+                        'django.core.cache.backends.locmem.LocMemCache')}}):
+                seed = os.path.join(directory, 'seed.sqlite3')
+                self.use_database(seed, 0)
+                call_command('migrate', verbosity=0)
+                self.seed(options['posts'], options['threads'])
+                results = {}
+                for profile, (pragmas, max_age) in PROFILES.items():
+                    path = os.path.join(directory, f'{profile}.sqlite3')
+                    connection.close()
+                    shutil.copy(seed, path)
+                    self.use_database(path, max_age)
+                    with override_settings(SQLITE_PRAGMAS=pragmas):
+                        results[profile] = self.run(options)
+        finally:
+            connection.close()
+            self.use_database(*saved)
+            shutil.rmtree(directory, ignore_errors=True)
+        self.report(results, options['seconds'])
+
+    @staticmethod
+    def use_database(name, max_age):
+        database = connections.databases['default']
+        database['NAME'] = name
+        database['CONN_MAX_AGE'] = max_age
+
+    def seed(self, posts, users):
+        User.objects.bulk_create(
+            [User(username=f'bench{i}') for i in range(users)])
+        authors = list(User.objects.filter(username__startswith='bench'))
+        Post.objects.bulk_create(
+            Post(text=f'Пост {i}', author=random.choice(authors))
+            for i in range(posts))
+        post_ids = list(Post.objects.values_list('pk', flat=True))
+        Comment.objects.bulk_create(
+            Comment(post_id=random.choice(post_ids),
+                    author=random.choice(authors), text='-')
+            for _ in range(posts * 2))
+        self.post_ids = post_ids
+        self.usernames = [author.username for author in authors]
+
+    def pick_request(self, client, write_ratio):
+        post_id = random.choice(self.post_ids)
+        if random.random() < write_ratio:
+            return 'write', lambda: client.post(
+                reverse('posts:add_comment', args=[post_id]),
+                {'text': 'Комментарий'})
+        if random.random() < 0.5:
+            return 'read', lambda: client.get(reverse('posts:index'))
+        return 'read', lambda: client.get(
+            reverse('posts:post_detail', args=[post_id]))
+
+    def measure(self, username, deadline, write_ratio):
+        """Запросы одного пользователя до deadline.
+
+        Ошибки блокировок SQLite и ответы 4xx/5xx - результат замера,
+        они считаются по тексту. Остальные исключения поднимаются.
+        """
+        client = Client()
+        client.force_login(User.objects.get(username=username))
+        samples = {'read': [], 'write': []}
+        errors = Counter()
+        while time.monotonic() < deadline:
+            kind, request = self.pick_request(client, write_ratio)
+            started = time.monotonic()
+            try:
+                response = request()
+            except OperationalError as error:
+                errors[f'OperationalError: {error}'] += 1
+                continue
+            if response.status_code >= 400:
+                errors[f'HTTP {response.status_code}'] += 1
+                continue
+            samples[kind].append(time.monotonic() - started)
+        return samples, errors
+
+    def run(self, options):
+        """Прогон профиля; исключение в любом потоке прерывает команду."""
+        deadline = time.monotonic() + options['seconds']
+        samples = {'read': [], 'write': []}
+        errors = Counter()
+        failures = []
+        lock = threading.Lock()
+
+        def worker(username):
+            try:
+                local, failed = self.measure(
+                    username, deadline, options['write_ratio'])
+            except Exception as error:
+                with lock:
+                    failures.append(error)
+                return
+            finally:
+                connection.close()
+            with lock:
+                for kind, values in local.items():
+                    samples[kind].extend(values)
+                errors.update(failed)
+
+        threads = [
+            threading.Thread(target=worker, args=(username,))
+            for username in self.usernames[:options['threads']]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if failures:
+            raise CommandError(
+                f'Прогон прерван: {failures[0]!r}') from failures[0]
+        return samples, errors
+
+    def report(self, results, seconds):
+        self.stdout.write(
+            f'{"профиль":<12}{"чтений/с":>10}{"записей/с":>11}'
+            f'{"p95 чтения, мс":>16}{"p95 записи, мс":>16}{"ошибок":>8}')
+        for profile, (samples, errors) in results.items():
+            self.stdout.write(
+                f'{profile:<12}'
+                f'{len(samples["read"]) / seconds:>10.1f}'
+                f'{len(samples["write"]) / seconds:>11.1f}'
+                f'{self.p95(samples["read"]):>16.1f}'
+                f'{self.p95(samples["write"]):>16.1f}'
+                f'{sum(errors.values()):>8}')
+        for profile, (samples, errors) in results.items():
+            for message, count in errors.most_common():
+                self.stderr.write(f'{profile}: {message} - {count}')
+
+    @staticmethod
+    def p95(values):
+        if not values:
+            return 0.0
+        values = sorted(values)
+        return values[int(len(values) * 0.95)] * 1000
@@ -0,0 +1,36 @@
+import os
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Обновляет реплики SQLite копией базы default через backup API. '
+        'Копия подменяет файл реплики атомарно.'
+    )
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        if primary['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('Команда копирует только базы SQLite.')
+        source = sqlite3.connect(primary['NAME'])
+        try:
+            for alias in settings.DATABASE_REPLICAS:
+                path = settings.DATABASES[alias]['NAME']
+                temporary = f'{path}.sync'
+                try:
+                    target = sqlite3.connect(temporary)
+                    try:
+                        source.backup(target)
+                    finally:
+                        target.close()
+                    os.replace(temporary, path)
+                except (sqlite3.Error, OSError) as error:
+                    raise CommandError(f'{alias}: {error}')
+                self.stdout.write(f'{alias}: {path}')
+        finally:
+            source.close()
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено реплик: {len(settings.DATABASE_REPLICAS)}'))
@@ -0,0 +1,180 @@
+import atexit
+import json
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+# Имя -> (тип, описание, границы корзин гистограммы).
+METRICS = {
+    'yatube_request_duration_seconds': (
+        'histogram', 'Время ответа по имени URL.', LATENCY_BUCKETS),
+    'yatube_db_queries': (
+        'histogram', 'Запросов к БД на один ответ по имени URL.',
+        QUERY_BUCKETS),
+    'yatube_responses_total': (
+        'counter', 'Ответы по имени URL и статусу.', None),
+    'yatube_cache_requests_total': (
+        'counter', 'Обращения к кешу фрагментов и страниц: hit, stale, '
+        'miss.', None),
+    'yatube_cache_tier_total': (
+        'counter', 'Чтения двухуровневого кеша: l1_hits, l2_hits, misses.',
+        None),
+    'yatube_thumbnail_jobs_total': (
+        'counter', 'Задания на миниатюры: done, retry, failed, requeued.',
+        None),
+    'yatube_thumbnail_duration_seconds': (
+        'histogram', 'Время подготовки миниатюр одного поста.',
+        LATENCY_BUCKETS),
+}
+
+
+def _labels(pairs):
+    return ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\')
+                         .replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in pairs)
+
+
+def _series(name, pairs, value):
+    labels = _labels(pairs)
+    if labels:
+        name = f'{name}{{{labels}}}'
+    return f'{name} {value:g}'
+
+
+class MetricsStore:
+    """Счётчики и гистограммы, общие для всех процессов WSGI.
+
+    Процесс копит приращения в памяти и не чаще раза в flush_interval
+    секунд прибавляет их к таблице в файле SQLite одной транзакцией.
+    render() сначала сбрасывает свои приращения, затем отдаёт сумму
+    по всем процессам в текстовом формате Prometheus.
+    """
+
+    def __init__(self, path, flush_interval=1):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending = defaultdict(float)
+        self._flushed = time.monotonic()
+
+    @property
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None,
+                check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS metrics ('
+                'name TEXT, labels TEXT, value REAL, '
+                'PRIMARY KEY (name, labels))')
+            self._local.db = db
+        return db
+
+    def inc(self, name, amount=1, **labels):
+        if name not in METRICS:
+            raise KeyError(f'Неизвестная метрика {name}')
+        key = (name, json.dumps(sorted(labels.items())))
+        with self._lock:
+            self._pending[key] += amount
+            due = time.monotonic() - self._flushed >= self.flush_interval
+        if due:
+            self.flush()
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        le = next((str(bound) for bound in buckets if value <= bound),
+                  '+Inf')
+        self.inc(name, le=le, **labels)
+        self.inc(name, value, le='sum', **labels)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(float)
+            self._flushed = time.monotonic()
+        if not pending:
+            return
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany(
+                'INSERT INTO metrics (name, labels, value) VALUES (?, ?, ?) '
+                'ON CONFLICT (name, labels) '
+                'DO UPDATE SET value = value + excluded.value',
+                [(name, labels, value)
+                 for (name, labels), value in pending.items()])
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def collect(self):
+        """{имя: {кортеж пар меток: значение}} по всем процессам."""
+        self.flush()
+        result = defaultdict(dict)
+        for name, labels, value in self._db.execute(
+                'SELECT name, labels, value FROM metrics'):
+            result[name][tuple(map(tuple, json.loads(labels)))] = value
+        return result
+
+    def render(self):
+        collected = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            series = collected.get(name, {})
+            if kind == 'histogram':
+                lines.extend(self._histogram(name, buckets, series))
+            else:
+                lines.extend(_series(name, pairs, value)
+                             for pairs, value in sorted(series.items()))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _histogram(name, buckets, series):
+        grouped = defaultdict(dict)
+        for pairs, value in series.items():
+            labels = dict(pairs)
+            le = labels.pop('le')
+            grouped[tuple(sorted(labels.items()))][le] = value
+        for pairs, counts in sorted(grouped.items()):
+            total = 0
+            for le in [*map(str, buckets), '+Inf']:
+                total += counts.get(le, 0)
+                yield _series(f'{name}_bucket', pairs + (('le', le),), total)
+            yield _series(f'{name}_sum', pairs, counts.get('sum', 0))
+            yield _series(f'{name}_count', pairs, total)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MetricsStore(
+                    settings.METRICS_PATH, settings.METRICS_FLUSH_INTERVAL)
+                atexit.register(_store.flush)
+    return _store
+
+
+def inc(name, amount=1, **labels):
+    get_store().inc(name, amount, **labels)
+
+
+def observe(name, value, **labels):
+    get_store().observe(name, value, **labels)
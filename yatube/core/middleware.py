@@ -0,0 +1,106 @@
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_state = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    """View выполнила больше запросов, чем разрешает QUERY_BUDGETS."""
+
+
+class RequestStats:
+    """Сколько запросов, времени в БД и в шаблонах стоил один запрос."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.rendering = False
+        self.total = None
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - started
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+
+    def as_dict(self):
+        return {
+            'queries': self.queries,
+            'db_ms': round(self.db_time * 1000, 1),
+            'template_ms': round(self.template_time * 1000, 1),
+            'total_ms': round(self.total * 1000, 1),
+        }
+
+
+def current_stats():
+    """RequestStats запроса, который обрабатывает этот поток, или None."""
+    return getattr(_state, 'stats', None)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else None
+
+
+class RequestStatsMiddleware:
+    """Считает запросы к БД, время БД, шаблонов и всего запроса.
+
+    Запросы дольше SLOW_REQUEST_MS пишутся в лог одной строкой JSON.
+    Если QUERY_BUDGET_STRICT, превышение QUERY_BUDGETS для имени URL
+    поднимает QueryBudgetExceeded - так тесты ловят лишние запросы.
+    Статистика остаётся в request.stats и попадает в /metrics.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = request.stats = _state.stats = RequestStats()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(stats.record_query))
+                response = self.get_response(request)
+        finally:
+            _state.stats = None
+            stats.finish()
+        name = view_name(request)
+        label = name or 'unresolved'
+        metrics.observe(
+            'yatube_request_duration_seconds', stats.total, view=label)
+        metrics.observe('yatube_db_queries', stats.queries, view=label)
+        metrics.inc('yatube_responses_total', view=label,
+                    status=response.status_code)
+        if stats.total * 1000 >= settings.SLOW_REQUEST_MS:
+            logger.warning(json.dumps({
+                'event': 'slow_request',
+                'view': name,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                **stats.as_dict(),
+            }, ensure_ascii=False))
+        budget = settings.QUERY_BUDGETS.get(name)
+        if (settings.QUERY_BUDGET_STRICT and budget is not None
+                and stats.queries > budget):
+            raise QueryBudgetExceeded(
+                f'{name}: {stats.queries} запросов к БД при бюджете {budget}')
+        return response
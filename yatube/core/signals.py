@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    """Применяет settings.SQLITE_PRAGMAS к новому соединению с default.
+
+    Файлы реплик подменяет sync_replicas, журнал WAL им не нужен.
+    """
+    if (connection.alias != 'default' or connection.vendor != 'sqlite'
+            or not settings.SQLITE_PRAGMAS):
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
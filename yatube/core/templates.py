@@ -0,0 +1,31 @@
+import time
+
+from django.template.backends.django import DjangoTemplates, Template
+
+from .middleware import current_stats
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        stats = current_stats()
+        if stats is None or stats.rendering:
+            # Вложенный render_to_string уже учтён внешним шаблоном.
+            return super().render(context, request)
+        stats.rendering = True
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - started
+            stats.rendering = False
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Шаблоны Django, время рендера которых попадает в RequestStats."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
@@ -0,0 +1,53 @@
+import hashlib
+
+from django import template
+
+from core.utils import mark_stale, single_flight
+
+register = template.Library()
+
+
+class FeedCacheNode(template.Node):
+    def __init__(self, nodelist, timeout, name, key, version):
+        self.nodelist = nodelist
+        self.timeout = timeout
+        self.name = name
+        self.key = key
+        self.version = version
+
+    def render(self, context):
+        version = self.version.resolve(context)
+        key = 'template.feedcache.{}.{}'.format(
+            self.name,
+            hashlib.md5(str(self.key.resolve(context)).encode()).hexdigest())
+
+        def build():
+            return version, self.nodelist.render(context)
+
+        value, stale = single_flight(
+            key, lambda cached: cached == version, build,
+            self.timeout.resolve(context), name='fragment')
+        if stale and context.get('request') is not None:
+            mark_stale(context['request'])
+        return value
+
+
+@register.tag('feedcache')
+def do_feedcache(parser, token):
+    """Кеширует фрагмент ленты с защитой от одновременной перестройки.
+
+        {% feedcache timeout name key version %}...{% endfeedcache %}
+
+    Ключ не меняется между поколениями ленты, поэтому, пока один
+    запрос строит фрагмент новой версии, остальные отдают прежний.
+    """
+    nodelist = parser.parse(('endfeedcache',))
+    parser.delete_first_token()
+    bits = token.split_contents()
+    if len(bits) != 5:
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' принимает timeout, name, key и version.")
+    timeout, name, key, version = bits[1:]
+    return FeedCacheNode(
+        nodelist, parser.compile_filter(timeout), name,
+        parser.compile_filter(key), parser.compile_filter(version))
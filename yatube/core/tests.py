@@ -1,4 +1,30 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from core import db_router, utils
+from core.cache import SQLiteCache, TwoTierCache
+from core.db_router import PIN_COOKIE, ReplicaRouter, replica_reads
+from core.metrics import MetricsStore
+from core.middleware import QueryBudgetExceeded
+from core.signals import tune_sqlite
+from core.utils import CountingPaginator, single_flight
+from posts import feeds
+from posts.models import Post
+
+User = get_user_model()
 
 
 class ViewTestClass(TestCase):
@@ -6,3 +32,297 @@ class ViewTestClass(TestCase):
         response = self.client.get('/nonexist-page/')
         self.assertEqual(response.status_code, 404)
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+class TwoTierCacheTest(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.shared = SQLiteCache(os.path.join(directory, 'cache.db'), {})
+        # Два экземпляра с общим L2 ведут себя как два процесса.
+        self.first, self.second = (self.make_tier(), self.make_tier())
+
+    def make_tier(self):
+        tier = TwoTierCache('shared', {'OPTIONS': {'STAMP_INTERVAL': 0}})
+        tier.l2 = self.shared
+        return tier
+
+    def test_sqlite_cache_incr_and_expiry(self):
+        self.shared.set('counter', 1)
+        self.assertEqual(self.shared.incr('counter', 2), 3)
+        self.shared.set('gone', 'value', -1)
+        self.assertIsNone(self.shared.get('gone'))
+        with self.assertRaises(ValueError):
+            self.shared.incr('gone')
+        self.shared.set('expired', 5, -1)
+        with self.assertRaises(ValueError):
+            self.shared.incr('expired')
+        self.assertTrue(self.shared.add('gone', {'a': 1}))
+        self.assertEqual(self.shared.get('gone'), {'a': 1})
+
+    def test_reads_are_served_from_l1(self):
+        self.first.set('key', 'value')
+        self.assertEqual(self.second.get('key'), 'value')
+        self.assertEqual(self.second.get('key'), 'value')
+        self.assertIsNone(self.second.get('missing'))
+        self.assertEqual(
+            self.second.stats(), {'l1_hits': 1, 'l2_hits': 1, 'misses': 1})
+
+    def test_writes_invalidate_other_processes(self):
+        self.first.set('key', 'old')
+        self.second.set('generation', 1)
+        self.assertEqual(self.second.get('key'), 'old')
+        self.assertEqual(self.first.get('generation'), 1)
+        self.first.set('key', 'new')
+        self.second.incr('generation')
+        self.second.delete('missing')
+        self.assertEqual(self.second.get('key'), 'new')
+        self.assertEqual(self.first.get('generation'), 2)
+        self.first.delete('key')
+        self.assertIsNone(self.second.get('key'))
+
+
+class SingleFlightTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.builds = 0
+
+    def build(self, version='v2'):
+        self.builds += 1
+        return version, f'value {self.builds}'
+
+    def test_only_lock_holder_rebuilds(self):
+        value, stale = single_flight('key', lambda v: v == 'v1',
+                                     lambda: self.build('v1'), 60)
+        self.assertEqual((value, stale), ('value 1', False))
+        # Другой процесс уже перестраивает значение новой версии.
+        cache.add('key:lock', 1)
+        value, stale = single_flight(
+            'key', lambda v: v == 'v2', self.build, 60)
+        self.assertEqual((value, stale), ('value 1', True))
+        self.assertEqual(self.builds, 1)
+        cache.delete('key:lock')
+        value, stale = single_flight(
+            'key', lambda v: v == 'v2', self.build, 60)
+        self.assertEqual((value, stale), ('value 2', False))
+
+    def test_entry_is_rebuilt_before_it_expires(self):
+        single_flight('key', lambda v: True, self.build, 60)
+        entry = cache.get('key')
+        entry['expires'] = time.time() + 1
+        entry['delta'] = 10 ** 6
+        cache.set('key', entry)
+        value, _ = single_flight('key', lambda v: True, self.build, 60)
+        self.assertEqual(value, 'value 2')
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class ReplicaRouterTest(TestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        db_router._down_until.clear()
+        self.addCleanup(db_router._down_until.clear)
+
+    def test_reads_go_to_replica_only_inside_block(self):
+        with mock.patch.object(db_router, '_available', return_value=True):
+            with replica_reads():
+                self.assertIn(
+                    self.router.db_for_read(User),
+                    ('replica1', 'replica2'))
+                self.assertEqual(self.router.db_for_write(User), 'default')
+        self.assertEqual(self.router.db_for_read(User), 'default')
+
+    def test_unavailable_replica_falls_back_to_primary(self):
+        available = {'replica1': False, 'replica2': True}
+        with mock.patch.object(
+                db_router, '_available', side_effect=available.get):
+            for _ in range(5):
+                with replica_reads():
+                    self.assertEqual(
+                        self.router.db_for_read(User), 'replica2')
+            self.assertIn('replica1', db_router._down_until)
+            available['replica2'] = False
+            with replica_reads():
+                self.assertEqual(self.router.db_for_read(User), 'default')
+
+    def test_writes_pin_user_to_primary(self):
+        user = User.objects.create_user(username='auth')
+        self.client.force_login(user)
+        response = self.client.post(
+            reverse('posts:post_create'), {'text': 'Пост'})
+        self.assertIn(PIN_COOKIE, response.cookies)
+        with mock.patch.object(db_router, 'replica_reads') as reads:
+            self.client.get(reverse('posts:index'))
+        reads.assert_not_called()
+
+    def test_replica_pages_have_no_validators(self):
+        """Отставшая реплика не должна получить свежий ETag."""
+        cache.clear()
+        # Реплики в тестах нет: «реплика» читает из default.
+        with mock.patch.object(
+                db_router, 'choose_replica', return_value='default'):
+            response = self.client.get(reverse('posts:index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+
+    def test_replica_feed_count_cached_briefly(self):
+        author = User.objects.create_user(username='author')
+        Post.objects.create(author=author, text='Пост')
+        with mock.patch.object(utils, 'cache') as fake_cache:
+            fake_cache.get.return_value = None
+            with mock.patch.object(
+                    db_router, 'choose_replica', return_value='default'):
+                with replica_reads():
+                    CountingPaginator(
+                        Post.objects.all(), 10, 'index').count
+        timeout = fake_cache.set.call_args[0][2]
+        self.assertEqual(timeout, settings.REPLICA_CACHE_TIMEOUT)
+
+    def test_replica_author_timelines_cached_briefly(self):
+        author = User.objects.create_user(username='author')
+        Post.objects.create(author=author, text='Пост')
+        with mock.patch.object(feeds, 'cache') as fake_cache:
+            fake_cache.get_many.return_value = {}
+            with mock.patch.object(
+                    db_router, 'choose_replica', return_value='default'):
+                with replica_reads():
+                    feeds.author_timelines([author.pk])
+        timeout = fake_cache.set_many.call_args[0][1]
+        self.assertEqual(timeout, settings.REPLICA_CACHE_TIMEOUT)
+
+
+class SQLitePragmasTest(TestCase):
+    def busy_timeout(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_applied_to_new_connection(self):
+        original = self.busy_timeout()
+        with override_settings(SQLITE_PRAGMAS={'busy_timeout': 1234}):
+            tune_sqlite(sender=None, connection=connection)
+        self.assertEqual(self.busy_timeout(), 1234)
+        with override_settings(SQLITE_PRAGMAS={'busy_timeout': original}):
+            tune_sqlite(sender=None, connection=connection)
+
+    @override_settings(SQLITE_PRAGMAS={})
+    def test_empty_profile_leaves_connection_alone(self):
+        original = self.busy_timeout()
+        tune_sqlite(sender=None, connection=connection)
+        self.assertEqual(self.busy_timeout(), original)
+
+
+class BenchmarkSQLiteTest(SimpleTestCase):
+    def metrics_file_state(self):
+        path = os.path.join(settings.BASE_DIR, 'metrics.sqlite3')
+        return os.stat(path).st_mtime if os.path.exists(path) else None
+
+    def test_short_run_reports_both_profiles(self):
+        # Отдельный процесс: команда сама переключает соединение.
+        metrics_state = self.metrics_file_state()
+        result = subprocess.run(
+            [sys.executable, 'manage.py', 'benchmark_sqlite',
+             '--seconds', '0.2', '--posts', '20', '--threads', '2'],
+            cwd=settings.BASE_DIR, check=True, stdout=subprocess.PIPE,
+            universal_newlines=True)
+        rows = [line.split()[0] for line in result.stdout.splitlines()[1:]]
+        self.assertEqual(rows, ['default', 'production'])
+        # Трафик прогона не попадает в метрики настоящего сайта.
+        self.assertEqual(self.metrics_file_state(), metrics_state)
+
+
+class RequestStatsMiddlewareTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_request_logged_with_stats(self):
+        with self.assertLogs('core.middleware', 'WARNING') as logs:
+            self.client.get(reverse('posts:index'))
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['view'], 'posts:index')
+        self.assertEqual(line['status'], 200)
+        self.assertGreater(line['queries'], 0)
+        self.assertGreater(line['template_ms'], 0)
+
+    @override_settings(QUERY_BUDGETS={'posts:index': 0})
+    def test_query_budget_fails_view(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('posts:index'))
+
+    @override_settings(
+        QUERY_BUDGETS={'posts:index': 0}, QUERY_BUDGET_STRICT=False)
+    def test_budget_ignored_outside_tests(self):
+        response = self.client.get(reverse('posts:index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(response.wsgi_request.stats.queries, 0)
+
+
+class MetricsTest(TestCase):
+    def test_processes_share_counters_and_histograms(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'metrics.sqlite3')
+        first, second = MetricsStore(path, 60), MetricsStore(path, 60)
+        first.inc('yatube_responses_total', view='posts:index', status=200)
+        second.inc('yatube_responses_total', view='posts:index', status=200)
+        first.observe('yatube_db_queries', 3, view='posts:index')
+        second.observe('yatube_db_queries', 30, view='posts:index')
+        second.flush()
+        text = first.render()
+        self.assertIn(
+            'yatube_responses_total{status="200",view="posts:index"} 2',
+            text)
+        self.assertIn(
+            'yatube_db_queries_bucket{view="posts:index",le="2"} 0', text)
+        self.assertIn(
+            'yatube_db_queries_bucket{view="posts:index",le="5"} 1', text)
+        self.assertIn(
+            'yatube_db_queries_bucket{view="posts:index",le="+Inf"} 2', text)
+        self.assertIn('yatube_db_queries_sum{view="posts:index"} 33', text)
+        self.assertIn('yatube_db_queries_count{view="posts:index"} 2', text)
+
+    def test_endpoint_reports_requests_and_page_cache(self):
+        cache.clear()
+        self.client.get(reverse('posts:index'))
+        self.client.get(reverse('posts:index'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn(
+            'yatube_responses_total{status="200",view="posts:index"}', text)
+        self.assertIn(
+            'yatube_request_duration_seconds_count{view="posts:index"}',
+            text)
+        self.assertIn(
+            'yatube_cache_requests_total{cache="page",result="hit"}', text)
+
+    def test_endpoint_hidden_from_outside(self):
+        response = self.client.get(
+            reverse('metrics'), REMOTE_ADDR='203.0.113.5')
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(METRICS_TRUSTED_PROXIES=('127.0.0.1',),
+                       METRICS_ALLOWED_IPS=('127.0.0.1', '10.0.0.5'))
+    def test_endpoint_behind_proxy_checks_forwarded_address(self):
+        cases = {
+            '203.0.113.5': 404,
+            '127.0.0.1, 203.0.113.5': 404,
+            '10.0.0.5': 200,
+            '': 404,
+        }
+        for forwarded, status in cases.items():
+            with self.subTest(forwarded=forwarded):
+                response = self.client.get(
+                    reverse('metrics'), HTTP_X_FORWARDED_FOR=forwarded)
+                self.assertEqual(response.status_code, status)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_endpoint_accepts_token(self):
+        for header, status in (('Bearer secret', 200), ('Bearer no', 404)):
+            with self.subTest(header=header):
+                response = self.client.get(
+                    reverse('metrics'), REMOTE_ADDR='203.0.113.5',
+                    HTTP_AUTHORIZATION=header)
+                self.assertEqual(response.status_code, status)
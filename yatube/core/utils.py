@@ -1,11 +1,491 @@
-from django.core.paginator import Paginator
+import base64
+import binascii
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
 
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db import connections, router
+from django.db.models import Q, QuerySet
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from django.utils.http import http_date
 
-def page_division(queryset, request, num):
-    """Разбивает посты на страницы."""
-    paginator = Paginator(queryset, num)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    return {
+from . import metrics
+from .db_router import reading_from_replica
+
+CURSOR_PARAM = 'cursor'
+FEED_COUNT_KEY = 'feed_count:{}'
+FEED_GENERATION_KEY = 'feed_generation:{}'
+FEED_CHANGED_KEY = 'feed_changed:{}'
+PAGE_CACHE_KEY = 'page:{}'
+
+
+def encode_cursor(obj, date_field='pub_date', reverse=False):
+    """Упаковывает ключ (дата, id) объекта в непрозрачный токен."""
+    payload = {'d': getattr(obj, date_field).isoformat(), 'i': obj.pk}
+    if reverse:
+        payload['r'] = 1
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Распаковывает токен; для битого токена возвращает None."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw.decode())
+        date = parse_datetime(payload['d'])
+        pk = int(payload['i'])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        return None
+    if date is None:
+        return None
+    return date, pk, bool(payload.get('r'))
+
+
+class CursorPage(Page):
+    """Страница ленты, построенная по ключу, а не по смещению."""
+
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        super().__init__(object_list, 1, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self._has_next:
+            return None
+        return encode_cursor(
+            self.object_list[-1], self.paginator.date_field)
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous:
+            return None
+        return encode_cursor(
+            self.object_list[0], self.paginator.date_field, reverse=True)
+
+
+class CursorPaginator(Paginator):
+    """Keyset-пагинация по (дата, id) без OFFSET и COUNT(*).
+
+    Стоимость любой страницы одинакова: выбирается per_page + 1 строк
+    по индексу начиная с ключа из токена. По умолчанию листает посты
+    от новых к старым; date_field и descending задают другой порядок.
+    """
+
+    def __init__(self, object_list, per_page, date_field='pub_date',
+                 descending=True, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.date_field = date_field
+        self.descending = descending
+
+    def _queryset(self, date, pk, backwards):
+        descending = self.descending != backwards
+        prefix = '-' if descending else ''
+        field = self.date_field
+        queryset = self.object_list.order_by(prefix + field, prefix + 'pk')
+        if date is not None:
+            # Нестрогая граница по дате отдельным условием: по ней
+            # SQLite спускается в индекс, а не перебирает ветки OR.
+            lookup = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{field}__{lookup}e': date})
+                & (Q(**{f'{field}__{lookup}': date})
+                   | Q(**{f'pk__{lookup}': pk})))
+        return queryset
+
+    def _rows(self, date, pk, backwards):
+        queryset = self._queryset(date, pk, backwards)
+        rows = list(queryset[:self.per_page + 1])
+        return rows[:self.per_page], len(rows) > self.per_page
+
+    def get_cursor_page(self, token):
+        cursor = decode_cursor(token)
+        if cursor is None:
+            rows, has_next = self._rows(None, None, False)
+            return CursorPage(rows, self, has_next, False)
+        date, pk, backwards = cursor
+        rows, has_more = self._rows(date, pk, backwards)
+        if backwards:
+            return CursorPage(rows[::-1], self, True, has_more)
+        return CursorPage(rows, self, has_more, True)
+
+
+def replica_timeout(timeout):
+    """Срок жизни записи кеша, построенной по прочитанным данным.
+
+    Реплика может отставать, поэтому прочитанное с неё хранится не
+    дольше REPLICA_CACHE_TIMEOUT: так отставание не закрепится в кеше.
+    """
+    if not reading_from_replica():
+        return timeout
+    if timeout is None:
+        return settings.REPLICA_CACHE_TIMEOUT
+    return min(timeout, settings.REPLICA_CACHE_TIMEOUT)
+
+
+class CountingPaginator(Paginator):
+    """Paginator со сменной стратегией подсчёта строк.
+
+    Стратегии задаются в settings.FEED_COUNT_STRATEGY:
+    'exact' - COUNT(*) на каждый запрос, 'cached' - точное число
+    хранится в кеше под ключом ленты, 'estimated' - подсчёт обрезается
+    на FEED_COUNT_CAP строках и тоже кешируется.
+    """
+
+    def __init__(self, object_list, per_page, count_key=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_key = count_key
+
+    def _count_rows(self):
+        if not isinstance(self.object_list, QuerySet):
+            return len(self.object_list)
+        if settings.FEED_COUNT_STRATEGY == 'estimated':
+            cap = settings.FEED_COUNT_CAP
+            return self.object_list.order_by().values('pk')[:cap].count()
+        return self.object_list.count()
+
+    @cached_property
+    def count(self):
+        if settings.FEED_COUNT_STRATEGY == 'exact' or not self.count_key:
+            return self._count_rows()
+        key = FEED_COUNT_KEY.format(self.count_key)
+        count = cache.get(key)
+        if count is None:
+            count = self._count_rows()
+            cache.set(
+                key, count, replica_timeout(settings.FEED_COUNT_TIMEOUT))
+        return count
+
+
+def invalidate_feed_counts(feeds):
+    """Сбрасывает закешированные размеры перечисленных лент."""
+    cache.delete_many([FEED_COUNT_KEY.format(feed) for feed in feeds])
+
+
+def _new_generation():
+    return int(time.time() * 1000)
+
+
+def feed_generation(feed):
+    """Текущее поколение ленты: меняется при каждом изменении её постов."""
+    return cache.get_or_set(
+        FEED_GENERATION_KEY.format(feed), _new_generation, None)
+
+
+def bump_feed_generations(feeds):
+    """Переводит ленты на новое поколение, делая их фрагменты устаревшими.
+
+    Если счётчик вытеснен из кеша, он начинается заново с отметки времени,
+    чтобы не совпасть ни с одним из прежних поколений.
+    """
+    for feed in feeds:
+        key = FEED_GENERATION_KEY.format(feed)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_generation(), None)
+    now = int(time.time())
+    cache.set_many(
+        {FEED_CHANGED_KEY.format(feed): now for feed in feeds}, None)
+
+
+def feed_validators(request, feeds):
+    """ETag и Last-Modified страницы, собранной из перечисленных лент.
+
+    ETag строится из поколений лент, пользователя, сессии и
+    CSRF-cookie, поэтому считается без запросов к базе, а после
+    нового входа страница с формой приходит со свежим CSRF-токеном.
+    Время изменения известно, только если все ленты менялись при
+    жизни кеша; иначе Last-Modified не отдаётся. Авторизованным он
+    не отдаётся вовсе: по дате не видно смены сессии.
+    """
+    authenticated = request.user.is_authenticated
+    user = request.user.pk if authenticated else 'anon'
+    session = getattr(request, 'session', None)
+    session_key = session.session_key if session is not None else None
+    csrf = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    generations = [f'{feed}={feed_generation(feed)}' for feed in feeds]
+    raw = ';'.join([f'user={user}', f'session={session_key}',
+                    f'csrf={csrf}', *generations])
+    etag = '"%s"' % hashlib.md5(raw.encode()).hexdigest()
+    if authenticated:
+        return etag, None
+    changed = cache.get_many(
+        [FEED_CHANGED_KEY.format(feed) for feed in feeds])
+    last_modified = None
+    if len(changed) == len(feeds):
+        last_modified = max(changed.values())
+    return etag, last_modified
+
+
+def conditional_feed(feeds_func):
+    """Отвечает 304 Not Modified, пока ленты страницы не менялись.
+
+    feeds_func(request, *args, **kwargs) возвращает ленты страницы или
+    None, если объекта нет: тогда вызывается сама view и отдаёт 404.
+    Страница, прочитанная с реплики, может отставать от текущих
+    поколений лент, поэтому для неё валидаторы не отдаются.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (request.method not in ('GET', 'HEAD')
+                    or reading_from_replica()):
+                return view(request, *args, **kwargs)
+            feeds = feeds_func(request, *args, **kwargs)
+            if feeds is None:
+                return view(request, *args, **kwargs)
+            etag, last_modified = feed_validators(request, feeds)
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            if getattr(request, 'served_stale', False):
+                patch_cache_control(response, no_cache=True)
+            elif response.status_code in (200, 304):
+                response['ETag'] = etag
+                if last_modified is not None:
+                    response['Last-Modified'] = http_date(last_modified)
+                patch_cache_control(response, no_cache=True)
+                patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
+
+
+def _expires_early(entry):
+    """Вероятностное досрочное истечение (XFetch).
+
+    Чем ближе срок записи и чем дольше она строилась, тем вероятнее,
+    что какой-то запрос перестроит её заранее, до общего промаха.
+    """
+    gap = -entry['delta'] * settings.CACHE_EARLY_BETA * math.log(
+        1 - random.random())
+    return time.time() + gap >= entry['expires']
+
+
+def _count_lookup(name, result):
+    if name is not None:
+        metrics.inc('yatube_cache_requests_total', cache=name, result=result)
+
+
+def single_flight(key, is_current, build, timeout, name=None):
+    """Значение из кеша, которое перестраивает только один процесс.
+
+    build() возвращает (версия, значение); версия None - не кешировать.
+    Пока один процесс держит блокировку и строит значение, остальные
+    получают прежнее, даже устаревшее. Запись живёт на
+    CACHE_STALE_TIMEOUT дольше timeout, чтобы было что отдать.
+    Значение, прочитанное с реплики, хранится не дольше
+    REPLICA_CACHE_TIMEOUT (см. replica_timeout).
+    Исход обращения считается в метрике под именем кеша name.
+    Возвращает (значение, устарело ли оно).
+    """
+    timeout = replica_timeout(timeout)
+    entry = cache.get(key)
+    if (entry is not None and is_current(entry['version'])
+            and not _expires_early(entry)):
+        _count_lookup(name, 'hit')
+        return entry['value'], False
+    lock = f'{key}:lock'
+    if not cache.add(lock, 1, settings.CACHE_LOCK_TIMEOUT):
+        if entry is not None:
+            stale = not is_current(entry['version'])
+            _count_lookup(name, 'stale' if stale else 'hit')
+            return entry['value'], stale
+        _count_lookup(name, 'miss')
+        return build()[1], False
+    _count_lookup(name, 'miss')
+    try:
+        started = time.monotonic()
+        version, value = build()
+        if version is not None:
+            cache.set(key, {
+                'version': version,
+                'value': value,
+                'expires': time.time() + timeout,
+                'delta': time.monotonic() - started,
+            }, timeout + settings.CACHE_STALE_TIMEOUT)
+    finally:
+        cache.delete(lock)
+    return value, False
+
+
+def mark_stale(request):
+    """Ответ собран из устаревших данных: его нельзя валидировать."""
+    request.served_stale = True
+
+
+def add_page_tags(request, tags):
+    """Отмечает, от каких лент и объектов зависит ответ на запрос."""
+    if not hasattr(request, 'page_tags'):
+        request.page_tags = set()
+    request.page_tags.update(tags)
+
+
+def _tag_versions(tags):
+    return {tag: feed_generation(tag) for tag in tags}
+
+
+def _page_is_cacheable(request, response):
+    return (response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+            and not request.META.get('CSRF_COOKIE_USED'))
+
+
+def cache_anonymous_page(feeds_func):
+    """Кеширует страницу целиком для гостей.
+
+    Запись хранит поколения тегов страницы: лент из feeds_func и
+    объектов, отмеченных view через add_page_tags. Запись действует,
+    пока ни один тег не сменил поколение, так что сигналы сбрасывают
+    ровно страницы с изменившимися постами, авторами и группами.
+    Поколения лент снимаются до запроса к базе: изменение, пришедшее
+    во время рендера, не останется в кеше. Перестраивает страницу
+    один запрос, остальные тем временем получают прежнюю копию.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (request.method not in ('GET', 'HEAD')
+                    or request.user.is_authenticated):
+                return view(request, *args, **kwargs)
+
+            def is_current(versions):
+                keys = {FEED_GENERATION_KEY.format(tag): version
+                        for tag, version in versions.items()}
+                return cache.get_many(list(keys)) == keys
+
+            def build():
+                feeds = feeds_func(request, *args, **kwargs)
+                if feeds is None:
+                    return None, view(request, *args, **kwargs)
+                versions = _tag_versions(feeds)
+                response = view(request, *args, **kwargs)
+                if not _page_is_cacheable(request, response):
+                    return None, response
+                tags = getattr(request, 'page_tags', set()) - versions.keys()
+                versions.update(_tag_versions(tags))
+                return versions, response
+
+            path = request.get_full_path()
+            key = PAGE_CACHE_KEY.format(
+                hashlib.md5(path.encode()).hexdigest())
+            response, stale = single_flight(
+                key, is_current, build, settings.PAGE_CACHE_TIMEOUT,
+                name='page')
+            if stale:
+                mark_stale(request)
+            return response
+        return wrapper
+    return decorator
+
+
+def _cursor_page_key(page):
+    """Ключ фрагмента по границам страницы, а не по тексту курсора.
+
+    Любой курсор, в том числе битый, который ведёт на те же строки,
+    попадает в тот же фрагмент: подбором курсоров кеш не засорить.
+    """
+    if not page.object_list:
+        return 'cursor=empty'
+    first, last = page.object_list[0], page.object_list[-1]
+    edges = f'{int(page.has_previous())}{int(page.has_next())}'
+    return f'cursor={first.pk}-{last.pk}:{edges}'
+
+
+def page_division(queryset, request, num, feed=None,
+                  cursor_field='pub_date'):
+    """Разбивает посты на страницы.
+
+    feed - имя ленты: под ним кешируется число её постов,
+    а в контекст добавляются ключ и версия фрагмента страницы.
+    cursor_field - поле даты, по которому лента отсортирована, для
+    keyset-пагинации.
+    Последовательности, не являющиеся QuerySet, делятся только
+    по номерам страниц.
+    """
+    keyset = (settings.FEED_PAGINATION == 'keyset'
+              or CURSOR_PARAM in request.GET)
+    if keyset and isinstance(queryset, QuerySet):
+        paginator = CursorPaginator(queryset, num, cursor_field)
+        page_obj = paginator.get_cursor_page(request.GET.get(CURSOR_PARAM))
+        page_key = _cursor_page_key(page_obj)
+    else:
+        paginator = CountingPaginator(queryset, num, feed)
+        page_number = request.GET.get('page')
+        page_obj = paginator.get_page(page_number)
+        page_key = f'page={page_obj.number}'
+    context = {
         'page_obj': page_obj,
     }
+    if feed is not None:
+        context['feed_cache_key'] = f'{feed}:{page_key}'
+        context['feed_cache_version'] = feed_generation(feed)
+        context['feed_cache_timeout'] = settings.FEED_CACHE_TIMEOUT
+    return context
+
+
+class LRUCache:
+    """Небольшой потокобезопасный LRU-кеш в памяти процесса."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def bulk_batch_size(model, batch_size, objs):
+    """batch_size для bulk_create, не больше предела базы.
+
+    Django 2.2 не урезает явно заданный batch_size, а SQLite не
+    принимает вставку больше 500 строк одним запросом.
+    """
+    ops = connections[router.db_for_write(model)].ops
+    limit = ops.bulk_batch_size(model._meta.concrete_fields, objs)
+    return max(min(batch_size, limit), 1)
@@ -1,5 +1,11 @@
+import hmac
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
 
+from . import metrics as metrics_store
+
 
 def page_not_found(request, exception):
     return render(request, 'core/404.html', {'path': request.path}, status=404)
@@ -15,3 +21,41 @@ def permission_denied(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+def client_ip(request):
+    """Адрес клиента с учётом доверенных прокси.
+
+    Прокси дописывают адрес в конец X-Forwarded-For, поэтому берётся
+    последний адрес, который не принадлежит METRICS_TRUSTED_PROXIES.
+    """
+    address = request.META.get('REMOTE_ADDR')
+    if address not in settings.METRICS_TRUSTED_PROXIES:
+        return address
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')
+    for address in reversed(forwarded):
+        address = address.strip()
+        if address not in settings.METRICS_TRUSTED_PROXIES:
+            return address or None
+    return None
+
+
+def has_metrics_token(request):
+    token = settings.METRICS_TOKEN
+    return bool(token) and hmac.compare_digest(
+        request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}')
+
+
+def metrics(request):
+    """Метрики всех процессов в формате Prometheus.
+
+    Доступны адресам из METRICS_ALLOWED_IPS, запросам с METRICS_TOKEN
+    и персоналу сайта.
+    """
+    if (client_ip(request) not in settings.METRICS_ALLOWED_IPS
+            and not has_metrics_token(request)
+            and not request.user.is_staff):
+        raise Http404
+    return HttpResponse(
+        metrics_store.get_store().render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8')
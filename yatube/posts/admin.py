@@ -1,8 +1,66 @@
+from django import forms
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
 
+from core.utils import CountingPaginator
+from .feeds import INDEX_FEED
 from .models import Post, Group
+from .search import fts_enabled, fts_query, matching_ids
 
-admin.site.register(Group)
+
+@admin.register(Group)
+class GroupAdmin(admin.ModelAdmin):
+    search_fields = ('title', 'slug')
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator списка постов без точного COUNT(*) по всей таблице.
+
+    Размер всего списка берётся из счётчика главной ленты, который
+    сбрасывают сигналы постов; для отфильтрованного списка подсчёт
+    обрезается на FEED_COUNT_CAP строках.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            return CountingPaginator(queryset, self.per_page, INDEX_FEED).count
+        cap = settings.FEED_COUNT_CAP
+        return queryset.order_by().values('pk')[:cap].count()
+
+
+class PreloadedAutocompleteSelect(AutocompleteSelect):
+    """Автодополнение, которое берёт выбранный объект из строки списка.
+
+    Обычный AutocompleteSelect читает подпись выбранного значения
+    отдельным запросом на каждую строку.
+    """
+
+    preloaded = None
+
+    def optgroups(self, name, value, attr=None):
+        selected = self.preloaded
+        values = [str(item) for item in value if item not in ('', None)]
+        if selected is None or values != [str(selected.pk)]:
+            return super().optgroups(name, value, attr)
+        options = []
+        if not self.is_required:
+            options.append(self.create_option(name, '', '', False, 0))
+        options.append(self.create_option(
+            name, selected.pk, str(selected), True, len(options)))
+        return [(None, options, 0)]
+
+
+class PostChangeListForm(forms.ModelForm):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        widget = self.fields['group'].widget
+        widget = getattr(widget, 'widget', widget)
+        widget.preloaded = self.instance.group
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -14,9 +72,34 @@ class PostAdmin(admin.ModelAdmin):
         'group'
     )
     list_editable = ('group',)
+    list_select_related = ('author', 'group')
+    autocomplete_fields = ('author', 'group')
     search_fields = ('text',)
     list_filter = ('pub_date',)
+    date_hierarchy = 'pub_date'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     empty_value_display = '-пусто-'
 
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'group' and 'widget' not in kwargs:
+            kwargs['widget'] = PreloadedAutocompleteSelect(
+                db_field.remote_field, self.admin_site,
+                using=kwargs.get('using'))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def get_changelist_form(self, request, **kwargs):
+        kwargs.setdefault('form', PostChangeListForm)
+        return super().get_changelist_form(request, **kwargs)
+
+    def get_search_results(self, request, queryset, search_term):
+        """Ищет по полнотекстовому индексу вместо icontains."""
+        if not fts_enabled() or not search_term:
+            return super().get_search_results(
+                request, queryset, search_term)
+        if not fts_query(search_term):
+            return queryset.none(), False
+        return queryset.filter(pk__in=matching_ids(search_term)), False
+
 
 admin.site.register(Post, PostAdmin)
@@ -1,3 +1,7 @@
 POSTS_LIMIT_P_PAGE = 10
+COMMENTS_LIMIT_P_PAGE = 20
 POST_TEXT_LIMIT = 15
 POSTS_FOR_PAGE_TEST = 13
+FEED_ENTRY_BATCH = 1000
+EXPORT_CHUNK = 2000
+AUTHOR_TIMELINE_BATCH = 100
@@ -0,0 +1,105 @@
+import csv
+import json
+from itertools import groupby, islice
+from operator import attrgetter
+
+from .constants import EXPORT_CHUNK
+from .models import Comment, Post
+
+EXPORT_FORMATS = ('jsonl', 'csv')
+CONTENT_TYPES = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+CSV_FIELDS = (
+    'kind', 'id', 'post_id', 'author', 'group', 'date', 'text', 'image')
+
+
+def export_posts(author=None, group=None):
+    """Посты для выгрузки в порядке id; фильтры задают автора или группу."""
+    posts = Post.objects.select_related('author', 'group').order_by('pk')
+    if author is not None:
+        posts = posts.filter(author=author)
+    if group is not None:
+        posts = posts.filter(group=group)
+    return posts
+
+
+def posts_with_comments(posts, chunk_size=EXPORT_CHUNK):
+    """Пары (пост, комментарии) без загрузки всей выборки в память.
+
+    Посты должны идти в порядке id. Они читаются курсором по chunk_size
+    строк, комментарии порции - тоже курсором в порядке (post_id, created),
+    так что в памяти одновременно только комментарии текущего поста.
+    """
+    posts = posts.iterator(chunk_size=chunk_size)
+    chunk = list(islice(posts, chunk_size))
+    while chunk:
+        comments = groupby(Comment.objects.filter(
+            post_id__in=[post.pk for post in chunk]
+        ).select_related('author').order_by(
+            'post_id', 'created', 'pk'
+        ).iterator(chunk_size=chunk_size), key=attrgetter('post_id'))
+        post_id, items = next(comments, (None, None))
+        for post in chunk:
+            if post.pk != post_id:
+                yield post, []
+                continue
+            yield post, list(items)
+            post_id, items = next(comments, (None, None))
+        chunk = list(islice(posts, chunk_size))
+
+
+def _post_record(post):
+    return {
+        'id': post.pk,
+        'author': post.author.username,
+        'group': post.group.slug if post.group else None,
+        'pub_date': post.pub_date.isoformat(),
+        'text': post.text,
+        'image': post.image.name or None,
+    }
+
+
+def _comment_record(comment):
+    return {
+        'id': comment.pk,
+        'author': comment.author.username,
+        'created': comment.created.isoformat(),
+        'text': comment.text,
+    }
+
+
+def jsonl_lines(posts):
+    for post, comments in posts_with_comments(posts):
+        record = _post_record(post)
+        record['comments'] = [_comment_record(item) for item in comments]
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+class _Echo:
+    """Псевдофайл для csv.writer: отдаёт строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(posts):
+    """Строки CSV: за каждым постом идут его комментарии."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_FIELDS)
+    for post, comments in posts_with_comments(posts):
+        record = _post_record(post)
+        yield writer.writerow((
+            'post', post.pk, post.pk, record['author'], record['group'],
+            record['pub_date'], post.text, record['image']))
+        for comment in comments:
+            yield writer.writerow((
+                'comment', comment.pk, post.pk, comment.author.username,
+                None, comment.created.isoformat(), comment.text, None))
+
+
+def export_lines(posts, export_format):
+    if export_format == 'csv':
+        return csv_lines(posts)
+    return jsonl_lines(posts)
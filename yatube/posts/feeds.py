@@ -0,0 +1,234 @@
+import heapq
+from itertools import islice
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
+from django.shortcuts import get_object_or_404
+
+from core.utils import replica_timeout
+from .constants import AUTHOR_TIMELINE_BATCH, FEED_ENTRY_BATCH
+from .models import Comment, FeedEntry, Follow, Post
+
+INDEX_FEED = 'index'
+# Дата записи FeedEntry, по которой отсортирована лента подписок.
+FOLLOW_CURSOR_FIELD = 'feed_date'
+AUTHOR_TIMELINE_KEY = 'author_timeline:{}'
+
+# Поля, которые выводят шаблоны лент: остальные колонки не выбираются.
+FEED_FIELDS = (
+    'id', 'text', 'pub_date', 'image', 'thumbnails_ready',
+    'author', 'group',
+    'author__username', 'author__first_name', 'author__last_name',
+    'group__title', 'group__slug',
+)
+
+
+def group_feed(group_id):
+    return f'group:{group_id}'
+
+
+def author_feed(author_id):
+    return f'author:{author_id}'
+
+
+def follow_feed(user_id):
+    return f'follow:{user_id}'
+
+
+def post_page(post_id):
+    """Ключ страницы поста: меняется с постом и его комментариями."""
+    return f'post:{post_id}'
+
+
+def post_feeds(post, group_ids=()):
+    """Ленты, в которых показывается пост, кроме лент подписчиков."""
+    feeds = [INDEX_FEED, author_feed(post.author_id)]
+    for group_id in {post.group_id, *group_ids}:
+        if group_id is not None:
+            feeds.append(group_feed(group_id))
+    return feeds
+
+
+def post_tags(posts):
+    """Ключи авторов и групп, которые выводятся вместе с постами.
+
+    Подходит и для комментариев: у них нет группы.
+    """
+    tags = set()
+    for post in posts:
+        tags.add(author_feed(post.author_id))
+        group_id = getattr(post, 'group_id', None)
+        if group_id is not None:
+            tags.add(group_feed(group_id))
+    return tags
+
+
+def feed_posts(**filters):
+    """Посты для лент вместе с авторами и группами одним запросом."""
+    return Post.objects.filter(**filters).select_related(
+        'author', 'group').only(*FEED_FIELDS)
+
+
+def follow_feed_posts(user):
+    """Лента подписок, прочитанная из материализованной таблицы FeedEntry.
+
+    Сортировка по дате из FeedEntry позволяет пройти индекс
+    (user, -pub_date) диапазоном и не сортировать посты. Дата
+    аннотирована, чтобы курсор фильтровал по тому же соединению.
+    """
+    return feed_posts(feed_entries__user=user).annotate(**{
+        FOLLOW_CURSOR_FIELD: F('feed_entries__pub_date'),
+    }).order_by(f'-{FOLLOW_CURSOR_FIELD}')
+
+
+def _bulk_add_entries(entries):
+    entries = iter(entries)
+    batch = list(islice(entries, FEED_ENTRY_BATCH))
+    while batch:
+        FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+        batch = list(islice(entries, FEED_ENTRY_BATCH))
+
+
+def fan_out_post(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    followers = Follow.objects.filter(
+        author_id=post.author_id).values_list('user_id', flat=True)
+    _bulk_add_entries(
+        FeedEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+        for user_id in followers.iterator()
+    )
+
+
+def fan_out_posts(posts):
+    """Раскладывает пачку новых постов по лентам подписчиков их авторов."""
+    followers = {}
+    follows = Follow.objects.filter(
+        author_id__in={post.author_id for post in posts}
+    ).values_list('author_id', 'user_id')
+    for author_id, user_id in follows.iterator():
+        followers.setdefault(author_id, []).append(user_id)
+    _bulk_add_entries(
+        FeedEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+        for post in posts
+        for user_id in followers.get(post.author_id, ())
+    )
+    return [follow_feed(user_id)
+            for user_ids in followers.values() for user_id in user_ids]
+
+
+def backfill_follow(user_id, author_id):
+    """Добавляет в ленту нового подписчика последние посты автора."""
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date').values_list('pk', 'pub_date')
+    _bulk_add_entries(
+        FeedEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+        for post_id, pub_date in posts[:settings.FOLLOW_FEED_BACKFILL]
+    )
+
+
+def trim_follow(user_id, author_id):
+    """Убирает посты автора из ленты отписавшегося пользователя."""
+    FeedEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id).delete()
+
+
+def _load_timelines(author_ids):
+    """Последние посты авторов одним запросом на пачку авторов.
+
+    Каждая ветка UNION ALL берёт не больше AUTHOR_TIMELINE_LIMIT
+    строк по индексу (author, -pub_date), так что запрос не читает
+    всю историю плодовитых авторов.
+    """
+    quote = connection.ops.quote_name
+    table = quote(Post._meta.db_table)
+    branch = (
+        f'SELECT * FROM (SELECT {quote("id")}, {quote("author_id")}, '
+        f'{quote("pub_date")} FROM {table} WHERE {quote("author_id")} = %s '
+        f'ORDER BY {quote("pub_date")} DESC LIMIT %s) AS t{{}}')
+    timelines = {author_id: [] for author_id in author_ids}
+    for start in range(0, len(author_ids), AUTHOR_TIMELINE_BATCH):
+        batch = author_ids[start:start + AUTHOR_TIMELINE_BATCH]
+        sql = ' UNION ALL '.join(
+            branch.format(number) for number in range(len(batch)))
+        params = []
+        for author_id in batch:
+            params += [author_id, settings.AUTHOR_TIMELINE_LIMIT]
+        for post in Post.objects.raw(sql, params):
+            timelines[post.author_id].append(
+                (post.pub_date.timestamp(), post.pk))
+    for timeline in timelines.values():
+        timeline.sort(reverse=True)
+    return timelines
+
+
+def author_timelines(author_ids):
+    """Кешированные списки (время, id) последних постов каждого автора.
+
+    Все списки читаются из кеша одним get_many, недостающие строятся
+    пачками по AUTHOR_TIMELINE_BATCH авторов и ограничены
+    AUTHOR_TIMELINE_LIMIT постами.
+    """
+    keys = {AUTHOR_TIMELINE_KEY.format(author_id): author_id
+            for author_id in author_ids}
+    timelines = cache.get_many(keys)
+    missing_ids = [author_id for key, author_id in keys.items()
+                   if key not in timelines]
+    if missing_ids:
+        missing = {
+            AUTHOR_TIMELINE_KEY.format(author_id): timeline
+            for author_id, timeline in _load_timelines(missing_ids).items()
+        }
+        cache.set_many(
+            missing, replica_timeout(settings.FEED_CACHE_TIMEOUT))
+        timelines.update(missing)
+    return list(timelines.values())
+
+
+def forget_author_timeline(author_id):
+    cache.delete(AUTHOR_TIMELINE_KEY.format(author_id))
+
+
+class MergedTimeline:
+    """Лента подписок в pull-режиме.
+
+    Страница получается k-путевым слиянием (heapq.merge) лент авторов,
+    после чего из базы одним запросом читаются только её посты.
+    Объект поддерживает len() и срезы, поэтому подходит для Paginator.
+    """
+
+    def __init__(self, author_ids):
+        self.timelines = author_timelines(author_ids)
+
+    def __len__(self):
+        return sum(len(timeline) for timeline in self.timelines)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError('MergedTimeline поддерживает только срезы.')
+        merged = heapq.merge(
+            *self.timelines, key=itemgetter(0), reverse=True)
+        ids = [post_id for _, post_id
+               in islice(merged, index.start, index.stop)]
+        posts = feed_posts().in_bulk(ids)
+        return [posts[post_id] for post_id in ids if post_id in posts]
+
+
+def pull_follow_feed(user):
+    author_ids = Follow.objects.filter(user=user).values_list(
+        'author_id', flat=True)
+    return MergedTimeline(list(author_ids))
+
+
+def post_comments(post_id):
+    """Комментарии поста с авторами без запросов на каждую строку."""
+    return Comment.objects.filter(post_id=post_id).select_related(
+        'author').order_by('created')
+
+
+def post_with_comments(post_id):
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), id=post_id)
+    return post, post_comments(post.pk)
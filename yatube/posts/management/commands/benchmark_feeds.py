@@ -0,0 +1,231 @@
+import json
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+from io import StringIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from posts.feeds import fan_out_posts
+from posts.management.commands.import_posts import keep_pub_date
+from posts.models import Comment, Follow, Group, Post, User
+
+VIEWS = (
+    'index', 'group_list', 'profile', 'follow_index', 'post_detail',
+    'add_comment',
+)
+SEED_BATCH = 10000
+FEED_PAGES = 5
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Наполняет временную базу постами с авторами, группами, '
+        'подписками и комментариями и для каждого размера из --sizes '
+        'замеряет задержку и число запросов к БД у лент, поста и '
+        'add_comment. Отчёт JSON можно сравнивать между коммитами.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+',
+            default=[10000, 100000, 1000000],
+            help='Размеры базы в постах, по возрастанию.')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument(
+            '--followers', type=int, default=100,
+            help='Сколько пользователей на кого-то подписаны.')
+        parser.add_argument(
+            '--follows', type=int, default=10,
+            help='На сколько авторов подписан каждый из них.')
+        parser.add_argument(
+            '--requests', type=int, default=50,
+            help='Сколько запросов к каждой view на каждом размере.')
+        parser.add_argument('--output', default='benchmark_feeds.json')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        database = connections.databases['default']
+        saved = database['NAME']
+        directory = tempfile.mkdtemp()
+        report = {
+            'commit': self.commit(),
+            'settings': {
+                'FEED_PAGINATION': settings.FEED_PAGINATION,
+                'FEED_COUNT_STRATEGY': settings.FEED_COUNT_STRATEGY,
+                'FOLLOW_FEED_ENGINE': settings.FOLLOW_FEED_ENGINE,
+            },
+            'options': {name: options[name] for name in (
+                'users', 'groups', 'followers', 'follows', 'requests',
+                'seed')},
+            'sizes': {},
+        }
+        try:
+            with override_settings(
+                    DEBUG=False, DATABASE_REPLICAS=[],
+                    QUERY_BUDGET_STRICT=False, METRICS_PATH=':memory:',
+                    CACHES={'default': {'BACKEND': (
+                        'django.core.cache.backends.locmem.LocMemCache')}}):
+                connection.close()
+                database['NAME'] = os.path.join(directory, 'bench.sqlite3')
+                call_command('migrate', verbosity=0)
+                self.seed_people(options)
+                for size in sorted(options['sizes']):
+                    started = time.monotonic()
+                    self.seed_posts(size)
+                    self.stdout.write(
+                        f'{size} постов: наполнение '
+                        f'{time.monotonic() - started:.0f} с')
+                    report['sizes'][str(size)] = self.measure(
+                        options['requests'])
+                    self.print_size(report['sizes'][str(size)])
+        finally:
+            connection.close()
+            database['NAME'] = saved
+            shutil.rmtree(directory, ignore_errors=True)
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            json.dump(report, output, ensure_ascii=False, indent=2,
+                      sort_keys=True)
+            output.write('\n')
+        self.stdout.write(self.style.SUCCESS(
+            f'Отчёт записан в {options["output"]}'))
+
+    @staticmethod
+    def commit():
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def seed_people(self, options):
+        User.objects.bulk_create(
+            User(pk=pk, username=f'bench{pk}')
+            for pk in range(1, options['users'] + 1))
+        Group.objects.bulk_create(
+            Group(pk=pk, title=f'Группа {pk}', slug=f'bench{pk}',
+                  description='')
+            for pk in range(1, options['groups'] + 1))
+        self.user_ids = list(range(1, options['users'] + 1))
+        self.group_ids = list(range(1, options['groups'] + 1))
+        follows = []
+        readers = self.user_ids[:options['followers']]
+        for user_id in readers:
+            authors = random.sample(
+                self.user_ids[:user_id - 1] + self.user_ids[user_id:],
+                options['follows'])
+            follows.extend(
+                Follow(user_id=user_id, author_id=author_id)
+                for author_id in authors)
+        Follow.objects.bulk_create(follows)
+        self.readers = readers
+        self.posts = 0
+        self.first_post = timezone.make_aware(datetime(2020, 1, 1))
+
+    def seed_posts(self, size):
+        """Дополняет базу постами до size; id и даты идут подряд."""
+        while self.posts < size:
+            first = self.posts + 1
+            last = min(self.posts + SEED_BATCH, size)
+            posts = [
+                Post(
+                    pk=pk,
+                    text=f'Пост {pk} ' * random.randint(1, 20),
+                    author_id=random.choice(self.user_ids),
+                    group_id=(random.choice(self.group_ids)
+                              if random.random() < 0.5 else None),
+                    pub_date=self.first_post + timedelta(minutes=pk),
+                    comments_count=random.choice((0, 0, 1, 2, 3)),
+                )
+                for pk in range(first, last + 1)
+            ]
+            with keep_pub_date(), transaction.atomic():
+                Post.objects.bulk_create(posts)
+                Comment.objects.bulk_create(
+                    Comment(post_id=post.pk,
+                            author_id=random.choice(self.user_ids),
+                            text='Комментарий')
+                    for post in posts for _ in range(post.comments_count))
+                if settings.FOLLOW_FEED_ENGINE == 'push':
+                    fan_out_posts(posts)
+            self.posts = last
+        call_command('recount_counters', stdout=StringIO())
+
+    def targets(self):
+        post_id = random.randint(1, self.posts)
+        page = random.randint(1, FEED_PAGES)
+        return {
+            'index': ('get', reverse('posts:index'), {'page': page}),
+            'group_list': ('get', reverse(
+                'posts:group_list',
+                args=[f'bench{random.choice(self.group_ids)}']),
+                {'page': page}),
+            'profile': ('get', reverse(
+                'posts:profile',
+                args=[f'bench{random.choice(self.user_ids)}']),
+                {'page': page}),
+            'follow_index': ('get', reverse('posts:follow_index'),
+                             {'page': page}),
+            'post_detail': ('get', reverse(
+                'posts:post_detail', args=[post_id]), {}),
+            'add_comment': ('post', reverse(
+                'posts:add_comment', args=[post_id]),
+                {'text': 'Комментарий'}),
+        }
+
+    def measure(self, requests):
+        """Задержки и запросы к БД авторизованного читателя.
+
+        Авторизованным не отдаются закешированные страницы целиком,
+        так что замер показывает работу view, а не кеша.
+        """
+        cache.clear()
+        client = Client()
+        client.force_login(User.objects.get(pk=self.readers[0]))
+        samples = {name: {'latency': [], 'queries': []} for name in VIEWS}
+        for _ in range(requests):
+            for name, (method, url, data) in self.targets().items():
+                started = time.perf_counter()
+                response = getattr(client, method)(url, data)
+                elapsed = time.perf_counter() - started
+                samples[name]['latency'].append(elapsed * 1000)
+                samples[name]['queries'].append(
+                    response.wsgi_request.stats.queries)
+        client.logout()
+        return {
+            name: {
+                'p50_ms': round(percentile(values['latency'], 0.5), 2),
+                'p95_ms': round(percentile(values['latency'], 0.95), 2),
+                'p99_ms': round(percentile(values['latency'], 0.99), 2),
+                'queries_max': max(values['queries']),
+                'queries_mean': round(
+                    sum(values['queries']) / len(values['queries']), 2),
+            }
+            for name, values in samples.items()
+        }
+
+    def print_size(self, results):
+        for name, result in results.items():
+            self.stdout.write(
+                f'  {name:<14} p50 {result["p50_ms"]:>8.1f} мс  '
+                f'p95 {result["p95_ms"]:>8.1f} мс  '
+                f'запросов {result["queries_max"]}')
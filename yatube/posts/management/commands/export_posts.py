@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.export import EXPORT_FORMATS, export_lines, export_posts
+from posts.models import Group, User
+
+
+class Command(BaseCommand):
+    help = 'Выгружает посты с комментариями в JSONL или CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=EXPORT_FORMATS, default='jsonl',
+            help='Формат выгрузки.')
+        parser.add_argument('--author', help='Только посты автора.')
+        parser.add_argument('--group', help='Только посты группы (slug).')
+        parser.add_argument(
+            '--output', help='Файл для выгрузки; по умолчанию stdout.')
+
+    def handle(self, *args, **options):
+        author = group = None
+        try:
+            if options['author']:
+                author = User.objects.get(username=options['author'])
+            if options['group']:
+                group = Group.objects.get(slug=options['group'])
+        except (User.DoesNotExist, Group.DoesNotExist) as error:
+            raise CommandError(error)
+        lines = export_lines(export_posts(author, group), options['format'])
+        if not options['output']:
+            self.write_lines(self.stdout, lines)
+            return
+        with open(options['output'], 'w', encoding='utf-8',
+                  newline='') as output:
+            self.write_lines(output, lines)
+
+    @staticmethod
+    def write_lines(output, lines):
+        for line in lines:
+            output.write(line)
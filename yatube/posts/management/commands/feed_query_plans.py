@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from posts.constants import POSTS_LIMIT_P_PAGE
+from posts.feeds import FEED_FIELDS, feed_posts, follow_feed_posts
+from posts.models import Comment, FeedEntry, Follow, Group, Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Печатает план и среднее время запросов лент. Чтобы сравнить '
+        'планы без индексов, выполните migrate posts 0008 и запустите '
+        'команду ещё раз: выбираются только колонки, которые есть в '
+        'текущей схеме, а лента подписок пропускается до 0010.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Сколько раз выполнить каждый запрос для замера.')
+
+    def feed_fields(self):
+        """FEED_FIELDS без полей, которых ещё нет в схеме базы."""
+        with connection.cursor() as cursor:
+            columns = {
+                column.name for column in
+                connection.introspection.get_table_description(
+                    cursor, Post._meta.db_table)
+            }
+        return [
+            field for field in FEED_FIELDS
+            if '__' in field or Post._meta.get_field(field).column in columns
+        ]
+
+    def get_queries(self):
+        fields = self.feed_fields()
+        queries = {'index': feed_posts().only(*fields)}
+        group = Group.objects.first()
+        if group is not None:
+            queries['group'] = feed_posts(group=group).only(*fields)
+        post = Post.objects.values('pk', 'author_id').first()
+        if post is not None:
+            queries['profile'] = feed_posts(
+                author_id=post['author_id']).only(*fields)
+            queries['comments'] = Comment.objects.filter(
+                post_id=post['pk']).order_by('created')
+        follow = Follow.objects.first()
+        has_feed = (FeedEntry._meta.db_table
+                    in connection.introspection.table_names())
+        if follow is not None and has_feed:
+            queries['follow'] = follow_feed_posts(
+                follow.user_id).only(*fields)
+        return queries
+
+    def handle(self, *args, **options):
+        for name, queryset in self.get_queries().items():
+            page = queryset[:POSTS_LIMIT_P_PAGE]
+            started = time.perf_counter()
+            for _ in range(options['repeat']):
+                list(page)
+            elapsed = (time.perf_counter() - started) / options['repeat']
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{name}: {elapsed * 1000:.2f} мс'))
+            self.stdout.write(page.explain())
@@ -0,0 +1,244 @@
+import csv
+import json
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from itertools import islice
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.utils import (bulk_batch_size, bump_feed_generations,
+                        invalidate_feed_counts)
+from posts.feeds import (INDEX_FEED, author_feed, fan_out_posts,
+                         forget_author_timeline, group_feed)
+from posts.models import Group, Post, ThumbnailJob, User, UserStats
+from posts.search import fts_enabled, index_posts
+
+
+@contextmanager
+def keep_pub_date():
+    """Даёт bulk_create сохранить дату публикации из источника.
+
+    Без этого auto_now_add подменит её временем импорта.
+    """
+    field = Post._meta.get_field('pub_date')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def read_jsonl(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_csv(stream):
+    yield from csv.DictReader(stream)
+
+
+READERS = {
+    'jsonl': read_jsonl,
+    'csv': read_csv,
+}
+
+
+class Lookup:
+    """Кеш id по естественному ключу: недостающие ключи пачки
+    читаются из базы одним запросом."""
+
+    def __init__(self, model, field, create=None):
+        self.model = model
+        self.field = field
+        self.create = create
+        self.ids = {}
+
+    def load(self, keys):
+        missing = {key for key in keys if key and key not in self.ids}
+        if not missing:
+            return
+        self.ids.update(self.model.objects.filter(
+            **{f'{self.field}__in': missing}
+        ).values_list(self.field, 'pk'))
+        if self.create is None:
+            return
+        for key in missing - self.ids.keys():
+            self.ids[key] = self.create(key).pk
+
+    def get(self, key):
+        return self.ids.get(key)
+
+
+class Command(BaseCommand):
+    help = (
+        'Массово загружает посты из файла JSONL или CSV. Каждая запись: '
+        'text, author (username), необязательные group (slug), '
+        'pub_date (ISO 8601) и image (имя файла в --images-dir).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='Файл с постами; "-" - читать из stdin.')
+        parser.add_argument(
+            '--format', choices=sorted(READERS),
+            help='Формат файла; по умолчанию по расширению.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько постов вставлять одним bulk_create.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='Сколько постов сохранять в одной транзакции.')
+        parser.add_argument(
+            '--images-dir',
+            help='Каталог, из которого копируются картинки постов.')
+        parser.add_argument(
+            '--create-missing', action='store_true',
+            help='Создавать неизвестных авторов и группы.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(
+            path)[1].lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError('Укажите --format: jsonl или csv.')
+        self.batch_size = options['batch_size']
+        self.images_dir = options['images_dir']
+        create = options['create_missing']
+        self.authors = Lookup(
+            User, 'username', self.create_author if create else None)
+        self.groups = Lookup(
+            Group, 'slug', self.create_group if create else None)
+        self.imported = self.skipped = 0
+        self.started = time.monotonic()
+        if path == '-':
+            self.import_stream(READERS[file_format](sys.stdin),
+                               options['chunk_size'])
+        else:
+            with open(path, encoding='utf-8', newline='') as stream:
+                self.import_stream(READERS[file_format](stream),
+                                   options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано постов: {self.imported}, '
+            f'пропущено: {self.skipped}, {self.rate()}'))
+
+    def rate(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return f'{self.imported / elapsed:.0f} постов/с'
+
+    @staticmethod
+    def create_author(username):
+        return User.objects.create_user(username=username)
+
+    @staticmethod
+    def create_group(slug):
+        return Group.objects.create(title=slug, slug=slug, description='')
+
+    def import_stream(self, records, chunk_size):
+        records = iter(records)
+        chunk = list(islice(records, chunk_size))
+        while chunk:
+            with keep_pub_date(), transaction.atomic():
+                posts = self.save_chunk(chunk)
+            if posts:
+                self.after_commit(posts)
+            self.imported += len(posts)
+            self.stdout.write(
+                f'Импортировано {self.imported} постов, {self.rate()}')
+            chunk = list(islice(records, chunk_size))
+
+    def build_post(self, record):
+        author_id = self.authors.get(record.get('author'))
+        text = record.get('text')
+        if author_id is None or not text:
+            return None
+        pub_date = record.get('pub_date')
+        pub_date = parse_datetime(pub_date) if pub_date else timezone.now()
+        if pub_date is None:
+            return None
+        if settings.USE_TZ and timezone.is_naive(pub_date):
+            pub_date = timezone.make_aware(pub_date)
+        post = Post(
+            text=text,
+            author_id=author_id,
+            group_id=self.groups.get(record.get('group')),
+            pub_date=pub_date,
+        )
+        image = record.get('image')
+        if image and self.images_dir:
+            try:
+                post.image = self.copy_image(post, image)
+            except OSError:
+                return None
+        return post
+
+    def copy_image(self, post, image):
+        with open(os.path.join(self.images_dir, image), 'rb') as source:
+            return default_storage.save(
+                post.image.field.generate_filename(post, image),
+                File(source))
+
+    def save_chunk(self, records):
+        self.follower_feeds = []
+        self.authors.load(record.get('author') for record in records)
+        self.groups.load(record.get('group') for record in records)
+        posts = []
+        for record in records:
+            post = self.build_post(record)
+            if post is None:
+                self.skipped += 1
+                self.stderr.write(f'Пропущена запись: {record}')
+            else:
+                posts.append(post)
+        if not posts:
+            return posts
+        Post.objects.bulk_create(
+            posts, batch_size=bulk_batch_size(Post, self.batch_size, posts))
+        self.assign_pks(posts)
+        if fts_enabled():
+            index_posts(posts)
+        jobs = [ThumbnailJob(post=post) for post in posts if post.image]
+        ThumbnailJob.objects.bulk_create(
+            jobs, batch_size=bulk_batch_size(
+                ThumbnailJob, self.batch_size, jobs))
+        for author_id, count in Counter(
+                post.author_id for post in posts).items():
+            UserStats.change(author_id, 'posts_count', count)
+        if settings.FOLLOW_FEED_ENGINE == 'push':
+            self.follower_feeds = fan_out_posts(posts)
+        return posts
+
+    @staticmethod
+    def assign_pks(posts):
+        """Проставляет id вставленным постам там, где bulk_create
+        их не возвращает (SQLite).
+
+        Транзакция держит блокировку записи с первой вставки, поэтому
+        последние len(posts) строк таблицы - это именно наши посты.
+        """
+        if posts[0].pk is not None:
+            return
+        ids = Post.objects.order_by('-pk').values_list(
+            'pk', flat=True)[:len(posts)]
+        for post, pk in zip(posts, reversed(list(ids))):
+            post.pk = pk
+
+    def after_commit(self, posts):
+        authors = {post.author_id for post in posts}
+        feeds = {INDEX_FEED, *map(author_feed, authors)}
+        feeds.update(group_feed(post.group_id) for post in posts
+                     if post.group_id is not None)
+        for author_id in authors:
+            forget_author_timeline(author_id)
+        bump_feed_generations(feeds)
+        invalidate_feed_counts(feeds | set(self.follower_feeds))
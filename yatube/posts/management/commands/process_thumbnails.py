@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import enqueue_thumbnails, process_pending
+
+
+class Command(BaseCommand):
+    help = 'Фоновый обработчик очереди миниатюр для картинок постов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Разобрать очередь один раз и завершиться.')
+        parser.add_argument(
+            '--sleep', type=float, default=2.0,
+            help='Пауза в секундах, когда очередь пуста.')
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Сколько заданий брать за один проход.')
+        parser.add_argument(
+            '--enqueue-missing', action='store_true',
+            help='Поставить в очередь картинки без адаптивных вариантов.')
+
+    def handle(self, *args, **options):
+        if options['enqueue_missing']:
+            posts = Post.objects.exclude(image='').filter(
+                image_variants__isnull=True).only('pk', 'image')
+            for post in posts.iterator():
+                enqueue_thumbnails(post)
+        while True:
+            done = process_pending(options['batch_size'])
+            if done:
+                self.stdout.write(f'Готово заданий: {done}')
+            if options['once']:
+                return
+            if not done:
+                time.sleep(options['sleep'])
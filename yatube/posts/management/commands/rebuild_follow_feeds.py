@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.feeds import backfill_follow
+from posts.models import FeedEntry, Follow
+
+
+class Command(BaseCommand):
+    help = (
+        'Заново заполняет таблицу FeedEntry по подпискам. Нужна после '
+        'работы с FOLLOW_FEED_ENGINE = "pull".'
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            FeedEntry.objects.all().delete()
+            follows = Follow.objects.values_list('user_id', 'author_id')
+            for user_id, author_id in follows.iterator():
+                backfill_follow(user_id, author_id)
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей в лентах: {FeedEntry.objects.count()}'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.search import fts_enabled, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Заново строит полнотекстовый индекс постов по таблице Post.'
+
+    def handle(self, *args, **options):
+        if not fts_enabled():
+            raise CommandError('Полнотекстовый индекс есть только в SQLite.')
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс перестроен.'))
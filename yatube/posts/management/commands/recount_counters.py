@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F
+
+from core.utils import bulk_batch_size
+from posts.models import Follow, Post, User, UserStats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счётчики постов и подписок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько строк обновлять одним запросом.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        with transaction.atomic():
+            posts_fixed = self.recount_comments(batch_size)
+            users_fixed = self.recount_users(batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено постов: {posts_fixed}, '
+            f'пользователей: {users_fixed}'))
+
+    def recount_comments(self, batch_size):
+        wrong = Post.objects.annotate(
+            real_count=Count('comments')
+        ).exclude(comments_count=F('real_count')).only('pk')
+        fixed = []
+        for post in wrong.iterator(chunk_size=batch_size):
+            post.comments_count = post.real_count
+            fixed.append(post)
+        Post.objects.bulk_update(
+            fixed, ['comments_count'], batch_size=batch_size)
+        return len(fixed)
+
+    def recount_users(self, batch_size):
+        def totals(queryset, field):
+            return dict(queryset.values_list(field).annotate(
+                total=Count('pk')).order_by())
+
+        posts = totals(Post.objects, 'author')
+        followers = totals(Follow.objects, 'author')
+        following = totals(Follow.objects, 'user')
+        existing = {
+            stats.pk: stats for stats in UserStats.objects.iterator(
+                chunk_size=batch_size)
+        }
+        to_create, to_update = [], []
+        user_ids = User.objects.values_list('pk', flat=True)
+        for user_id in user_ids.iterator(chunk_size=batch_size):
+            real = UserStats(
+                user_id=user_id,
+                posts_count=posts.get(user_id, 0),
+                followers_count=followers.get(user_id, 0),
+                following_count=following.get(user_id, 0),
+            )
+            stats = existing.get(user_id)
+            if stats is None:
+                to_create.append(real)
+            elif (stats.posts_count, stats.followers_count,
+                  stats.following_count) != (
+                    real.posts_count, real.followers_count,
+                    real.following_count):
+                to_update.append(real)
+        UserStats.objects.bulk_create(
+            to_create,
+            batch_size=bulk_batch_size(UserStats, batch_size, to_create))
+        UserStats.objects.bulk_update(
+            to_update,
+            ['posts_count', 'followers_count', 'following_count'],
+            batch_size=batch_size)
+        return len(to_create) + len(to_update)
@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Greatest
 from django.contrib.auth import get_user_model
 
 from posts import constants
@@ -17,7 +18,22 @@ class Group(models.Model):
         return self.title
 
 
-class Post(models.Model):
+class CountedModel(models.Model):
+    """Модель, от которой зависят денормализованные счётчики.
+
+    Сохранение идёт в транзакции, поэтому сигналы, обновляющие
+    счётчики, либо применяются вместе с записью, либо не применяются.
+    """
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class Post(CountedModel):
     text = models.TextField('Текст поста', help_text='Введите текст поста')
     pub_date = models.DateTimeField('Дата публикации', auto_now_add=True)
     author = models.ForeignKey(
@@ -40,17 +56,28 @@ class Post(models.Model):
         upload_to='posts/',
         blank=True
     )
+    comments_count = models.PositiveIntegerField(
+        'Число комментариев', default=0, editable=False)
+    thumbnails_ready = models.BooleanField(
+        'Миниатюры готовы', default=False, editable=False)
 
     class Meta:
         ordering = ('-pub_date',)
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        indexes = (
+            models.Index(fields=('-pub_date',), name='post_pub_date_idx'),
+            models.Index(
+                fields=('author', '-pub_date'), name='post_author_pub_idx'),
+            models.Index(
+                fields=('group', '-pub_date'), name='post_group_pub_idx'),
+        )
 
     def __str__(self):
         return self.text[:num]
 
 
-class Comment(models.Model):
+class Comment(CountedModel):
     post = models.ForeignKey(
         Post,
         on_delete=models.CASCADE,
@@ -66,8 +93,14 @@ class Comment(models.Model):
                             help_text='Введите комментарий')
     created = models.DateTimeField('Создано', auto_now_add=True)
 
+    class Meta:
+        indexes = (
+            models.Index(
+                fields=('post', 'created'), name='comment_post_created_idx'),
+        )
+
 
-class Follow(models.Model):
+class Follow(CountedModel):
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -78,3 +111,149 @@ class Follow(models.Model):
         on_delete=models.CASCADE,
         related_name='following',
         verbose_name='Автор поста')
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'author'), name='unique_follow'),
+        )
+
+
+class FeedEntry(models.Model):
+    """Строка материализованной ленты подписок пользователя.
+
+    Заполняется при публикации поста (fan-out on write), поэтому лента
+    читается диапазоном по индексу (user, -pub_date) без соединения
+    с Follow.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Читатель')
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Пост')
+    pub_date = models.DateTimeField('Дата публикации поста')
+
+    class Meta:
+        verbose_name = 'Запись ленты подписок'
+        verbose_name_plural = 'Записи ленты подписок'
+        indexes = (
+            models.Index(
+                fields=('user', '-pub_date'), name='feed_entry_user_pub_idx'),
+        )
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'post'), name='unique_feed_entry'),
+        )
+
+
+class ThumbnailJob(models.Model):
+    """Задание фоновому обработчику: подготовить миниатюры картинки поста.
+
+    Очередь хранится в базе и разбирается командой process_thumbnails.
+    """
+
+    post = models.OneToOneField(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='thumbnail_job',
+        verbose_name='Пост')
+    created = models.DateTimeField('Создано', auto_now_add=True)
+    locked_at = models.DateTimeField('Взято в работу', null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField('Попыток', default=0)
+
+    class Meta:
+        ordering = ('created',)
+        verbose_name = 'Задание на миниатюры'
+        verbose_name_plural = 'Задания на миниатюры'
+
+
+class ImageVariant(models.Model):
+    """Вариант картинки поста определённой ширины и формата.
+
+    Размеры хранятся, чтобы шаблон выводил width и height без чтения файла.
+    """
+
+    FORMATS = (
+        ('webp', 'WebP'),
+        ('jpeg', 'JPEG'),
+    )
+
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='image_variants',
+        verbose_name='Пост')
+    format = models.CharField('Формат', max_length=4, choices=FORMATS)
+    width = models.PositiveIntegerField('Ширина')
+    height = models.PositiveIntegerField('Высота')
+    name = models.CharField('Файл', max_length=255)
+
+    class Meta:
+        ordering = ('width',)
+        verbose_name = 'Вариант картинки'
+        verbose_name_plural = 'Варианты картинок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('post', 'format', 'width'),
+                name='unique_image_variant'),
+        )
+
+
+class UserStats(models.Model):
+    """Денормализованные счётчики пользователя.
+
+    Поддерживаются сигналами posts.signals, чинятся командой recount_counters.
+    """
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Пользователь')
+    posts_count = models.PositiveIntegerField('Число постов', default=0)
+    followers_count = models.PositiveIntegerField(
+        'Число подписчиков', default=0)
+    following_count = models.PositiveIntegerField(
+        'Число подписок', default=0)
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+    @classmethod
+    def for_user(cls, user):
+        """Счётчики пользователя; недостающая строка создаётся пересчётом."""
+        try:
+            return user.stats
+        except cls.DoesNotExist:
+            return cls.recount(user.pk)
+
+    @classmethod
+    def recount(cls, user_id):
+        stats, _ = cls.objects.update_or_create(user_id=user_id, defaults={
+            'posts_count': Post.objects.filter(author_id=user_id).count(),
+            'followers_count': Follow.objects.filter(
+                author_id=user_id).count(),
+            'following_count': Follow.objects.filter(
+                user_id=user_id).count(),
+        })
+        return stats
+
+    @classmethod
+    def change(cls, user_id, field, delta):
+        """Сдвигает счётчик одним UPDATE без гонок чтения-записи.
+
+        Для уменьшения недостающая строка не создаётся: пользователь
+        мог быть удалён каскадом.
+        """
+        updated = cls.objects.filter(pk=user_id).update(
+            **{field: Greatest(models.F(field) + delta, 0)})
+        if not updated and delta > 0:
+            cls.recount(user_id)
@@ -0,0 +1,118 @@
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .feeds import feed_posts
+
+FTS_TABLE = 'posts_post_fts'
+SNIPPET_TOKENS = 16
+# Служебные символы вместо <mark>: текст сниппета экранируется,
+# и только потом они превращаются в теги подсветки.
+MARK_OPEN, MARK_CLOSE = '\x02', '\x03'
+WORD_RE = re.compile(r'\w+')
+
+
+def fts_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def fts_query(text):
+    """Превращает ввод пользователя в безопасный запрос FTS5.
+
+    Каждое слово берётся в кавычки и ищется по префиксу, слова
+    объединяются через AND.
+    """
+    return ' '.join(f'"{word}"*' for word in WORD_RE.findall(text))
+
+
+def index_posts(posts):
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, text) VALUES (%s, %s)',
+            [(post.pk, post.text) for post in posts])
+
+
+def index_post(post):
+    index_posts([post])
+
+
+def unindex_post(post_id, text):
+    """Убирает пост из индекса; FTS5 с внешним содержимым требует
+    прежний текст."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, text) '
+            f'VALUES (\'delete\', %s, %s)',
+            [post_id, text])
+
+
+def rebuild_index():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES (\'rebuild\')')
+
+
+def matching_ids(text):
+    """Подзапрос с id постов, подходящих под поиск, для фильтра pk__in."""
+    return RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+        [fts_query(text)])
+
+
+def _highlight(snippet):
+    return mark_safe(escape(snippet).replace(
+        MARK_OPEN, '<mark>').replace(MARK_CLOSE, '</mark>'))
+
+
+class SearchResults:
+    """Найденные посты, упорядоченные по bm25, со сниппетами.
+
+    Поддерживает len() и срезы, поэтому делится на страницы обычным
+    Paginator: для страницы выполняется один запрос к индексу и один
+    за самими постами.
+    """
+
+    def __init__(self, text):
+        self.query = fts_query(text)
+
+    def __len__(self):
+        if not self.query:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT COUNT(*) FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s', [self.query])
+            return cursor.fetchone()[0]
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError('SearchResults поддерживает только срезы.')
+        if not self.query:
+            return []
+        start = index.start or 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid, snippet({FTS_TABLE}, 0, %s, %s, %s, %s) '
+                f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY rank LIMIT %s OFFSET %s',
+                [MARK_OPEN, MARK_CLOSE, '…', SNIPPET_TOKENS, self.query,
+                 index.stop - start, start])
+            rows = cursor.fetchall()
+        posts = feed_posts().in_bulk([post_id for post_id, _ in rows])
+        found = []
+        for post_id, snippet in rows:
+            post = posts.get(post_id)
+            if post is not None:
+                post.snippet = _highlight(snippet)
+                found.append(post)
+        return found
+
+
+def search_posts(text):
+    """Результаты поиска; без SQLite - простой icontains по тексту."""
+    if fts_enabled():
+        return SearchResults(text)
+    return feed_posts(text__icontains=text)
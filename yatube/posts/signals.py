@@ -0,0 +1,134 @@
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from core.utils import bump_feed_generations, invalidate_feed_counts
+from .feeds import (INDEX_FEED, author_feed, backfill_follow, fan_out_post,
+                    follow_feed, forget_author_timeline, group_feed,
+                    post_feeds, post_page, trim_follow)
+from .models import Comment, Follow, Group, Post, User, UserStats
+from .search import fts_enabled, index_post, unindex_post
+from .thumbnails import enqueue_thumbnails
+
+
+def _push_feeds_enabled():
+    return settings.FOLLOW_FEED_ENGINE == 'push'
+
+
+def _follower_feeds(author_id):
+    followers = Follow.objects.filter(
+        author_id=author_id).values_list('user_id', flat=True)
+    return [follow_feed(user_id) for user_id in followers]
+
+
+@receiver(pre_save, sender=Post)
+def remember_old_values(sender, instance, **kwargs):
+    """При редактировании запоминает прежние группу, картинку и текст."""
+    instance._old_group_id, instance._old_image = None, ''
+    instance._old_text = None
+    if instance.pk is not None:
+        old = Post.objects.filter(pk=instance.pk).values_list(
+            'group_id', 'image', 'text').first()
+        if old is not None:
+            (instance._old_group_id, instance._old_image,
+             instance._old_text) = old
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    if instance.image and instance.image.name != getattr(
+            instance, '_old_image', ''):
+        enqueue_thumbnails(instance)
+    old_text = getattr(instance, '_old_text', None)
+    if fts_enabled() and old_text != instance.text:
+        if old_text is not None:
+            unindex_post(instance.pk, old_text)
+        index_post(instance)
+    old_group_id = getattr(instance, '_old_group_id', None)
+    feeds = post_feeds(instance, [old_group_id])
+    bump_feed_generations(feeds + [post_page(instance.pk)])
+    if not created and old_group_id == instance.group_id:
+        return
+    if created:
+        UserStats.change(instance.author_id, 'posts_count', 1)
+        forget_author_timeline(instance.author_id)
+        if _push_feeds_enabled():
+            fan_out_post(instance)
+        feeds += _follower_feeds(instance.author_id)
+    invalidate_feed_counts(feeds)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    if fts_enabled():
+        unindex_post(instance.pk, instance.text)
+    UserStats.change(instance.author_id, 'posts_count', -1)
+    forget_author_timeline(instance.author_id)
+    feeds = post_feeds(instance)
+    bump_feed_generations(feeds + [post_page(instance.pk)])
+    invalidate_feed_counts(feeds + _follower_feeds(instance.author_id))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def follow_changed(sender, instance, **kwargs):
+    if kwargs.get('created') is False:
+        return
+    delta = 1 if kwargs.get('created') else -1
+    UserStats.change(instance.user_id, 'following_count', delta)
+    UserStats.change(instance.author_id, 'followers_count', delta)
+    if _push_feeds_enabled():
+        if delta > 0:
+            backfill_follow(instance.user_id, instance.author_id)
+        else:
+            trim_follow(instance.user_id, instance.author_id)
+    invalidate_feed_counts([follow_feed(instance.user_id)])
+    # Профили обоих показывают счётчики подписок.
+    bump_feed_generations(
+        [author_feed(instance.user_id), author_feed(instance.author_id)])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    if kwargs.get('created') is False:
+        return
+    delta = 1 if kwargs.get('created') else -1
+    Post.objects.filter(pk=instance.post_id).update(
+        comments_count=Greatest(F('comments_count') + delta, 0))
+    bump_feed_generations([post_page(instance.post_id)])
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    if not created:
+        bump_feed_generations([group_feed(instance.pk)])
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    """Имя автора выводится рядом с его постами и комментариями.
+
+    Фрагменты лент версионируются поколением самой ленты, поэтому
+    сдвигаются и все ленты с постами автора: общая, его групп и
+    подписчиков.
+    """
+    if created:
+        # Счётчики нового пользователя нулевые: строка создаётся сразу,
+        # чтобы первый просмотр профиля не пересчитывал их.
+        if not kwargs.get('raw'):
+            UserStats.objects.get_or_create(user_id=instance.pk)
+        return
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    feeds = [author_feed(instance.pk)]
+    group_ids = set(Post.objects.filter(
+        author_id=instance.pk).values_list('group_id', flat=True).distinct())
+    if group_ids:
+        feeds.append(INDEX_FEED)
+        feeds += [group_feed(group_id) for group_id in group_ids
+                  if group_id is not None]
+        feeds += _follower_feeds(instance.pk)
+    bump_feed_generations(feeds)
@@ -0,0 +1,37 @@
+from django import template
+from sorl.thumbnail import default
+
+from posts.models import Post
+from posts.thumbnails import prefetch_thumbnails as prefetch
+
+register = template.Library()
+
+
+@register.simple_tag
+def prefetch_thumbnails(posts):
+    """Разрешает миниатюры всех постов страницы одним пакетом."""
+    if isinstance(posts, Post):
+        posts = [posts]
+    prefetch(posts)
+    return ''
+
+
+@register.inclusion_tag('posts/includes/responsive_image.html')
+def responsive_image(post, sizes='(min-width: 992px) 960px, 100vw'):
+    """<picture> с WebP и JPEG вариантами, размерами и ленивой загрузкой."""
+    storage = default.storage
+    srcsets = {}
+    for variant in post.variants:
+        srcsets.setdefault(variant.format, []).append(
+            f'{storage.url(variant.name)} {variant.width}w')
+    jpegs = [variant for variant in post.variants
+             if variant.format == 'jpeg'] or post.variants
+    fallback = min(jpegs, key=lambda variant: abs(variant.width - 960))
+    return {
+        'sizes': sizes,
+        'webp_srcset': ', '.join(srcsets.get('webp', [])),
+        'jpeg_srcset': ', '.join(srcsets.get('jpeg', [])),
+        'src': storage.url(fallback.name),
+        'width': fallback.width,
+        'height': fallback.height,
+    }
@@ -1,16 +1,31 @@
 import shutil
 import tempfile
+from unittest import mock
 
 from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 
-from posts.models import Post, Group, User
+from posts.models import ImageVariant, Post, Group, ThumbnailJob, User
+from posts.thumbnails import (LOCK_TIMEOUT, _hot_thumbnails,
+                              enqueue_thumbnails, process_pending)
 from posts.forms import PostForm
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
 
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
@@ -128,3 +143,97 @@ class PostCreateFormTests(TestCase):
             reverse('posts:post_detail',
                     kwargs={'post_id': self.post.pk}))
         self.assertEqual(response.context.get('post').image, self.post.image)
+
+    def test_thumbnails_are_generated_in_background(self):
+        """Миниатюры готовятся очередью, до этого выводится заглушка."""
+        self.authorized_client.post(reverse('posts:post_create'), data={
+            'text': 'Пост с картинкой',
+            'image': SimpleUploadedFile(
+                name='queued.gif', content=SMALL_GIF,
+                content_type='image/gif'),
+        })
+        post = Post.objects.get(text='Пост с картинкой')
+        self.assertFalse(post.thumbnails_ready)
+        self.assertTrue(ThumbnailJob.objects.filter(post=post).exists())
+        address = reverse('posts:post_detail', kwargs={'post_id': post.pk})
+        self.assertNotContains(
+            self.authorized_client.get(address), 'card-img my-2" src')
+        self.assertEqual(process_pending(), 1)
+        post.refresh_from_db()
+        self.assertTrue(post.thumbnails_ready)
+        self.assertFalse(ThumbnailJob.objects.exists())
+        self.assertContains(
+            self.authorized_client.get(address), 'card-img my-2" src')
+
+    def test_pending_skips_claimed_jobs(self):
+        """Занятые задания не съедают limit: берутся свободные и истёкшие."""
+        now = timezone.now()
+        for locked_at in (now, now, None, now - LOCK_TIMEOUT * 2):
+            ThumbnailJob.objects.create(
+                post=Post.objects.create(author=self.user, text='Очередь'),
+                locked_at=locked_at)
+        self.assertEqual(process_pending(limit=2), 2)
+        self.assertEqual(
+            ThumbnailJob.objects.filter(locked_at=now).count(), 2)
+        self.assertEqual(ThumbnailJob.objects.count(), 2)
+
+    def test_image_changed_during_job_is_requeued(self):
+        """Смена картинки во время обработки оставляет задание в очереди."""
+        post = Post.objects.create(
+            author=self.user, text='Смена картинки',
+            image=SimpleUploadedFile(
+                name='changed.gif', content=SMALL_GIF,
+                content_type='image/gif'))
+        with mock.patch('posts.thumbnails.generate_thumbnails',
+                        side_effect=enqueue_thumbnails):
+            self.assertEqual(process_pending(), 0)
+        post.refresh_from_db()
+        self.assertFalse(post.thumbnails_ready)
+        self.assertTrue(ThumbnailJob.objects.filter(
+            post=post, locked_at=None, attempts=0).exists())
+        self.assertEqual(process_pending(), 1)
+
+    def test_page_thumbnails_are_resolved_in_one_lookup(self):
+        """Миниатюры страницы читаются из хранилища sorl одним запросом."""
+        for i in range(3):
+            Post.objects.create(
+                author=self.user,
+                text=f'Картинка {i}',
+                image=SimpleUploadedFile(
+                    name=f'batch{i}.gif', content=SMALL_GIF,
+                    content_type='image/gif'),
+            )
+        process_pending()
+        ImageVariant.objects.all().delete()
+        cache.clear()
+        _hot_thumbnails.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('posts:index'))
+        kvstore_queries = [
+            query for query in queries
+            if 'thumbnail_kvstore' in query['sql']
+        ]
+        self.assertEqual(len(kvstore_queries), 1)
+        self.assertEqual(
+            response.content.decode().count('card-img my-2" src'), 3)
+
+    def test_responsive_variants_are_rendered(self):
+        """Варианты картинки выводятся через srcset с размерами."""
+        post = Post.objects.create(
+            author=self.user,
+            text='Адаптивная картинка',
+            image=SimpleUploadedFile(
+                name='variants.gif', content=SMALL_GIF,
+                content_type='image/gif'),
+        )
+        process_pending()
+        self.assertEqual(
+            set(post.image_variants.values_list('format', 'width')),
+            {(image_format, width) for image_format in ('webp', 'jpeg')
+             for width in (480, 960, 1440)})
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': post.pk}))
+        for fragment in ('type="image/webp"', '960w', 'width="960"',
+                         'height="339"', 'loading="lazy"'):
+            with self.subTest(fragment=fragment):
+                self.assertContains(response, fragment)
@@ -1,6 +1,20 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from io import StringIO
 
-from ..models import Group, Post, User
+from django.conf import settings
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.test import SimpleTestCase, TestCase
+
+from ..feeds import feed_posts
+from ..models import (Comment, FeedEntry, Follow, Group, Post, User,
+                      UserStats)
+from ..search import search_posts
 from posts.constants import POST_TEXT_LIMIT as NUM
 
 
@@ -57,3 +71,165 @@ class PostModelTest(TestCase):
             with self.subTest(field=field):
                 self.assertEqual(
                     post._meta.get_field(field).help_text, expected_value)
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.user = User.objects.create_user(username='user')
+
+    def stats(self, user):
+        return UserStats.objects.get(user=user)
+
+    def test_counters_follow_writes(self):
+        """Счётчики меняются при создании и удалении записей."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        comment = Comment.objects.create(
+            post=post, author=self.user, text='Комментарий')
+        follow = Follow.objects.create(user=self.user, author=self.author)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+        self.assertEqual(self.stats(self.author).followers_count, 1)
+        self.assertEqual(self.stats(self.user).following_count, 1)
+        comment.delete()
+        follow.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        self.assertEqual(self.stats(self.author).followers_count, 0)
+        self.assertEqual(self.stats(self.user).following_count, 0)
+        post.delete()
+        self.assertEqual(self.stats(self.author).posts_count, 0)
+
+    def test_recount_command_repairs_counters(self):
+        """Команда recount_counters чинит рассинхронизированные счётчики."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        Comment.objects.create(post=post, author=self.user, text='-')
+        Post.objects.update(comments_count=10)
+        UserStats.objects.update(posts_count=10)
+        UserStats.objects.filter(user=self.user).delete()
+        call_command('recount_counters', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+        self.assertEqual(self.stats(self.user).posts_count, 0)
+
+    def test_recount_creates_stats_for_many_users(self):
+        """Недостающих UserStats больше, чем SQLite вставит за раз."""
+        User.objects.bulk_create(
+            User(username=f'user{i}') for i in range(700))
+        call_command('recount_counters', stdout=StringIO())
+        self.assertEqual(
+            UserStats.objects.count(), User.objects.count())
+
+
+class SchemaTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.user = User.objects.create_user(username='user')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='-')
+        cls.post = Post.objects.create(
+            author=cls.author, text='Пост', group=cls.group)
+
+    def test_feed_queries_use_indexes(self):
+        """Запросы лент и комментариев идут по составным индексам."""
+        plans = {
+            'post_group_pub_idx': feed_posts(group=self.group),
+            'post_author_pub_idx': feed_posts(author=self.author),
+            'comment_post_created_idx': Comment.objects.filter(
+                post=self.post).order_by('created'),
+        }
+        for index, queryset in plans.items():
+            with self.subTest(index=index):
+                self.assertIn(index, queryset.explain())
+
+    def test_follow_is_unique(self):
+        """Повторная подписка на того же автора запрещена."""
+        Follow.objects.create(user=self.user, author=self.author)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Follow.objects.create(user=self.user, author=self.author)
+
+
+class ImportPostsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='-')
+        Post.objects.create(author=cls.author, text='Старый пост')
+        Follow.objects.create(
+            user=User.objects.create_user(username='reader'),
+            author=cls.author)
+
+    def import_file(self, suffix, content, *args):
+        with tempfile.NamedTemporaryFile(
+                'w', suffix=suffix, encoding='utf-8', delete=False) as file:
+            file.write(content)
+        self.addCleanup(os.remove, file.name)
+        call_command('import_posts', file.name, *args,
+                     stdout=StringIO(), stderr=StringIO())
+
+    def test_import_jsonl(self):
+        """Импорт JSONL сохраняет даты и обновляет производные данные."""
+        records = [
+            {'text': f'Импорт {i}', 'author': 'author', 'group': 'group',
+             'pub_date': f'2020-01-0{i + 1}T12:00:00'}
+            for i in range(5)
+        ] + [{'text': 'Без автора', 'author': 'nobody'}]
+        self.import_file(
+            '.jsonl', '\n'.join(map(json.dumps, records)),
+            '--chunk-size', '2', '--batch-size', '1')
+        imported = Post.objects.filter(text__startswith='Импорт')
+        self.assertEqual(imported.count(), 5)
+        self.assertEqual(imported.filter(group=self.group).count(), 5)
+        self.assertEqual(imported.earliest('pub_date').pub_date.year, 2020)
+        self.assertFalse(Post.objects.filter(text='Без автора').exists())
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).posts_count, 6)
+        self.assertEqual(FeedEntry.objects.filter(
+            post__in=imported).count(), 5)
+        self.assertEqual(len(search_posts('Импорт')), 5)
+
+    def test_import_more_rows_than_sqlite_allows_per_insert(self):
+        """Пачка по умолчанию больше предела SQLite на одну вставку."""
+        self.import_file('.csv', 'text,author\n' + ''.join(
+            f'Пачка {i},author\n' for i in range(600)))
+        self.assertEqual(
+            Post.objects.filter(text__startswith='Пачка').count(), 600)
+
+    def test_import_csv_creates_missing(self):
+        """CSV с --create-missing создаёт авторов и группы."""
+        self.import_file(
+            '.csv', 'text,author,group\nПост,newbie,new-group\n',
+            '--create-missing')
+        post = Post.objects.get(text='Пост')
+        self.assertEqual(post.author.username, 'newbie')
+        self.assertEqual(post.group.slug, 'new-group')
+
+
+class BenchmarkFeedsTest(SimpleTestCase):
+    def test_default_run_writes_report(self):
+        """Команда с настройками по умолчанию, уменьшены только данные.
+
+        Запускается отдельным процессом: она сама переключает
+        соединение на временную базу.
+        """
+        directory = tempfile.mkdtemp()
+        output = os.path.join(directory, 'report.json')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        subprocess.run(
+            [sys.executable, 'manage.py', 'benchmark_feeds',
+             '--sizes', '300', '--requests', '2', '--output', output],
+            cwd=settings.BASE_DIR, check=True, stdout=subprocess.DEVNULL)
+        with open(output, encoding='utf-8') as report:
+            results = json.load(report)['sizes']['300']
+        self.assertEqual(set(results), {
+            'index', 'group_list', 'profile', 'follow_index',
+            'post_detail', 'add_comment'})
+        self.assertGreater(results['index']['queries_max'], 0)
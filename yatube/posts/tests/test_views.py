@@ -1,11 +1,27 @@
-from django.test import Client, TestCase
+import csv
+import hashlib
+import io
+import json
+from unittest import mock
+
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from django import forms
 from django.core.cache import cache
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.test.utils import CaptureQueriesContext
 
-from posts.models import Post, Group, User, Comment, Follow
+from core.utils import PAGE_CACHE_KEY, CursorPage, CursorPaginator
+from posts import feeds
+from posts.feeds import (FOLLOW_CURSOR_FIELD, author_timelines,
+                         backfill_follow, feed_posts, follow_feed_posts)
+from posts.export import export_posts, posts_with_comments
+from posts.models import (Comment, FeedEntry, Follow, Group, Post, User,
+                          UserStats)
 from posts.constants import POSTS_FOR_PAGE_TEST as PAGES_NUM
 from posts.constants import POSTS_LIMIT_P_PAGE as NUM
+from posts.constants import COMMENTS_LIMIT_P_PAGE as COMMENTS_NUM
 
 
 class PostPagesTest(TestCase):
@@ -170,18 +186,46 @@ class PostPagesTest(TestCase):
         self.assertNotIn(self.post, group_2)
 
     def test_index_page_cache(self):
+        """Фрагмент ленты кешируется и сбрасывается при новом посте."""
         response = self.client.get(reverse('posts:index'))
         post_cont = response.content
-        new_post = Post.objects.create(
+        Post.objects.filter(pk=self.post.pk).update(text='Изменён в обход')
+        response = self.client.get(reverse('posts:index'))
+        self.assertEqual(post_cont, response.content)
+        Post.objects.create(
             text='New post',
             author=self.user,)
         response = self.client.get(reverse('posts:index'))
-        new_post = response.content
-        self.assertEqual(post_cont, new_post)
-        cache.clear()
-        response = self.client.get(reverse('posts:index'))
-        post_cache = response.content
-        self.assertNotEqual(new_post, post_cache)
+        self.assertNotEqual(post_cont, response.content)
+        self.assertContains(response, 'New post')
+
+    def test_feed_cache_depends_on_page(self):
+        """Разные страницы ленты не делят один фрагмент кеша."""
+        for i in range(NUM):
+            Post.objects.create(text=f'text{i}', author=self.user)
+        first_page = self.client.get(reverse('posts:index')).content
+        second_page = self.client.get(
+            reverse('posts:index') + '?page=2').content
+        self.assertNotEqual(first_page, second_page)
+        self.assertContains(
+            self.client.get(reverse('posts:index') + '?page=2'),
+            self.post.text)
+
+    def test_feed_cache_follows_author_name(self):
+        """Фрагменты лент с постами автора сбрасываются при смене имени."""
+        addresses = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+        )
+        for address in addresses:
+            self.authorized_client.get(address)
+        self.user.first_name = 'Новое'
+        self.user.last_name = 'Имя'
+        self.user.save()
+        for address in addresses:
+            with self.subTest(address=address):
+                self.assertContains(
+                    self.authorized_client.get(address), 'Новое Имя')
 
 
 class PaginatorViewsTest(TestCase):
@@ -228,6 +272,209 @@ class PaginatorViewsTest(TestCase):
                     len(response.context['page_obj']), PAGES_NUM - NUM)
 
 
+@override_settings(FEED_PAGINATION='keyset')
+class KeysetPaginatorViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        for i in range(PAGES_NUM):
+            Post.objects.create(text=f'text{i}', author=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_fragment_key_ignores_cursor_text(self):
+        """Битые курсоры и курсоры на ту же страницу делят фрагмент."""
+        keys = {
+            self.client.get(reverse('posts:index'), params).context[
+                'feed_cache_key']
+            for params in ({}, {'cursor': 'garbage'}, {'cursor': 'e30'})
+        }
+        self.assertEqual(len(keys), 1)
+
+    def test_pages_follow_cursor(self):
+        """Курсор ведёт на следующую страницу и обратно."""
+        response = self.client.get(reverse('posts:index'))
+        first_page = response.context['page_obj']
+        self.assertIsInstance(first_page, CursorPage)
+        self.assertEqual(len(first_page), NUM)
+        self.assertFalse(first_page.has_previous())
+        self.assertTrue(first_page.has_next())
+        response = self.client.get(
+            reverse('posts:index'), {'cursor': first_page.next_cursor})
+        second_page = response.context['page_obj']
+        self.assertEqual(len(second_page), PAGES_NUM - NUM)
+        self.assertFalse(second_page.has_next())
+        self.assertTrue(second_page.has_previous())
+        self.assertFalse(set(first_page) & set(second_page))
+        response = self.client.get(
+            reverse('posts:index'), {'cursor': second_page.previous_cursor})
+        self.assertEqual(
+            list(response.context['page_obj']), list(first_page))
+
+    def test_broken_cursor_shows_first_page(self):
+        """Битый курсор приводит на первую страницу."""
+        response = self.client.get(
+            reverse('posts:index'), {'cursor': 'broken'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['page_obj'].has_previous())
+
+    def test_cursor_query_seeks_index(self):
+        """Страница после курсора читается по индексу без сортировки."""
+        post = Post.objects.latest('pub_date')
+        follower = User.objects.create_user(username='follower')
+        Follow.objects.create(user=follower, author=self.user)
+        backfill_follow(follower.pk, self.user.pk)
+        feeds = {
+            'index': CursorPaginator(feed_posts(), NUM),
+            'follow': CursorPaginator(
+                follow_feed_posts(follower), NUM, FOLLOW_CURSOR_FIELD),
+        }
+        for name, paginator in feeds.items():
+            with self.subTest(feed=name):
+                plan = paginator._queryset(
+                    post.pub_date, post.pk, False).explain()
+                self.assertNotIn('MULTI-INDEX OR', plan)
+                self.assertNotIn('TEMP B-TREE FOR ORDER BY', plan)
+
+    def test_follow_feed_pages_follow_cursor(self):
+        """Лента подписок листается курсором по датам FeedEntry."""
+        follower = User.objects.create_user(username='follower')
+        Follow.objects.create(user=follower, author=self.user)
+        backfill_follow(follower.pk, self.user.pk)
+        self.client.force_login(follower)
+        first_page = self.client.get(
+            reverse('posts:follow_index')).context['page_obj']
+        self.assertEqual(len(first_page), NUM)
+        second_page = self.client.get(
+            reverse('posts:follow_index'),
+            {'cursor': first_page.next_cursor}).context['page_obj']
+        self.assertEqual(len(second_page), PAGES_NUM - NUM)
+        self.assertFalse(set(first_page) & set(second_page))
+
+
+class FeedCountTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        for i in range(PAGES_NUM):
+            Post.objects.create(
+                text=f'text{i}', author=cls.user, group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_count(self, address):
+        response = self.client.get(address)
+        return response.context['page_obj'].paginator.count
+
+    def test_count_is_cached_and_invalidated(self):
+        """Число постов кешируется и сбрасывается при создании поста."""
+        addresses = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+        ]
+        for address in addresses:
+            with self.subTest(address=address):
+                self.assertEqual(self.get_count(address), PAGES_NUM)
+        Post.objects.create(text='new', author=self.user, group=self.group)
+        for address in addresses:
+            with self.subTest(address=address):
+                self.assertEqual(self.get_count(address), PAGES_NUM + 1)
+
+    def test_group_change_invalidates_both_groups(self):
+        """Перенос поста в другую группу обновляет обе ленты."""
+        group_2 = Group.objects.create(
+            title='Вторая группа', slug='test-slug-2', description='-')
+        address = reverse('posts:group_list', kwargs={'slug': group_2.slug})
+        self.assertEqual(self.get_count(address), 0)
+        post = Post.objects.first()
+        post.group = group_2
+        post.save()
+        self.assertEqual(self.get_count(address), 1)
+
+    @override_settings(FEED_COUNT_STRATEGY='estimated', FEED_COUNT_CAP=NUM)
+    def test_estimated_count_is_capped(self):
+        """В режиме оценки подсчёт ограничен FEED_COUNT_CAP."""
+        self.assertEqual(self.get_count(reverse('posts:index')), NUM)
+
+
+class QueryBudgetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            text='Тестовый пост', author=cls.user, group=cls.group)
+        Comment.objects.create(post=cls.post, author=cls.user, text='-')
+        Follow.objects.create(
+            user=User.objects.create_user(username='follower'),
+            author=cls.user,
+        )
+
+    def setUp(self):
+        self.follower_client = Client()
+        self.follower_client.force_login(
+            User.objects.get(username='follower'))
+
+    def count_queries(self):
+        addresses = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+            reverse('posts:follow_index'),
+        ]
+        counts = {}
+        for address in addresses:
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.follower_client.get(address)
+            counts[address] = len(queries)
+        return counts
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        """Число запросов не растёт с числом постов и комментариев."""
+        before = self.count_queries()
+        for i in range(NUM):
+            group = Group.objects.create(
+                title=f'Группа {i}', slug=f'group-{i}', description='-')
+            Post.objects.create(
+                text=f'text{i}', author=self.user, group=group)
+            Comment.objects.create(
+                post=self.post,
+                author=User.objects.create_user(username=f'user{i}'),
+                text=f'comment{i}',
+            )
+        self.assertEqual(self.count_queries(), before)
+
+    def test_new_user_profile_fits_budget(self):
+        """Профиль нового пользователя укладывается в бюджет запросов.
+
+        Счётчики создаются вместе с пользователем, поэтому view их не
+        пересчитывает; превышение бюджета в тестах поднимает исключение.
+        """
+        newbie = User.objects.create_user(username='newbie')
+        self.assertTrue(UserStats.objects.filter(user=newbie).exists())
+        cache.clear()
+        response = self.follower_client.get(
+            reverse('posts:profile', kwargs={'username': 'newbie'}))
+        self.assertEqual(response.status_code, 200)
+
+
 class CommentTest(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -258,6 +505,31 @@ class CommentTest(TestCase):
         self.assertEqual(first_object.author, self.comment.author)
         self.assertEqual(first_object.id, self.comment.id)
 
+    def test_comments_are_paginated(self):
+        """Комментарии выводятся порциями, следующая приходит фрагментом."""
+        for i in range(COMMENTS_NUM):
+            Comment.objects.create(
+                post=self.post, author=self.any_user, text=f'comment{i}')
+        response = self.client.get(reverse(
+            'posts:post_detail', kwargs={'post_id': self.post.pk}))
+        first_page = response.context['comments']
+        self.assertEqual(len(first_page), COMMENTS_NUM)
+        self.assertEqual(first_page[0], self.comment)
+        response = self.client.get(
+            reverse('posts:comments', kwargs={'post_id': self.post.pk}),
+            {'cursor': first_page.next_cursor})
+        self.assertTemplateUsed(response, 'posts/includes/comments.html')
+        self.assertEqual(
+            list(response.context['comments']),
+            list(Comment.objects.order_by('created')[COMMENTS_NUM:]))
+        self.assertContains(response, f'comment{COMMENTS_NUM - 1}')
+
+    def test_comments_fragment_for_missing_post(self):
+        """Фрагмент комментариев несуществующего поста отдаёт 404."""
+        response = self.client.get(
+            reverse('posts:comments', kwargs={'post_id': 0}))
+        self.assertEqual(response.status_code, 404)
+
 
 class FollowTest(TestCase):
     @classmethod
@@ -282,6 +554,7 @@ class FollowTest(TestCase):
 
     def test_authorized_client_follow(self):
         '''Авторизованный пользователь может подписываться'''
+        self.follow.delete()
         follow_count = Follow.objects.count()
         follow_data = {
             'user': self.user,
@@ -297,6 +570,14 @@ class FollowTest(TestCase):
             author=self.author,
             user=self.user).exists())
 
+    def test_repeated_follow_keeps_one_row(self):
+        '''Повторная подписка не создаёт дубликат'''
+        address = reverse('posts:profile_follow', args=[self.author.username])
+        self.authorized_client.get(address)
+        self.authorized_client.get(address)
+        self.assertEqual(Follow.objects.filter(
+            author=self.author, user=self.user).count(), 1)
+
     def test_authorized_client_unfollow(self):
         '''Авторизованный пользователь может отподписываться'''
         follow_count = Follow.objects.count()
@@ -320,3 +601,448 @@ class FollowTest(TestCase):
         '''Запись не появляется в ленте unfollower'''
         response = self.authorized_author.get(reverse('posts:follow_index'))
         self.assertNotIn(self.post, response.context['page_obj'])
+
+    def test_follow_backfills_and_unfollow_trims_feed(self):
+        '''Подписка добавляет старые посты в ленту, отписка убирает их'''
+        reader = Client()
+        reader.force_login(User.objects.create_user(username='Reader'))
+        reader.get(reverse(
+            'posts:profile_follow', args=[self.author.username]))
+        response = reader.get(reverse('posts:follow_index'))
+        self.assertIn(self.post, response.context['page_obj'])
+        reader.get(reverse(
+            'posts:profile_unfollow', args=[self.author.username]))
+        response = reader.get(reverse('posts:follow_index'))
+        self.assertNotIn(self.post, response.context['page_obj'])
+        self.assertFalse(FeedEntry.objects.filter(
+            user__username='Reader').exists())
+
+
+@override_settings(FOLLOW_FEED_ENGINE='pull')
+class PullFollowFeedTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='User')
+        authors = [
+            User.objects.create_user(username=f'Author{i}') for i in range(3)
+        ]
+        for author in authors:
+            Follow.objects.create(user=cls.user, author=author)
+        for i in range(PAGES_NUM):
+            Post.objects.create(text=f'text{i}', author=authors[i % 3])
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def get_page(self, page=1):
+        response = self.authorized_client.get(
+            reverse('posts:follow_index'), {'page': page})
+        return list(response.context['page_obj'])
+
+    def test_merged_feed_matches_join(self):
+        '''Слияние лент авторов совпадает с лентой из базы'''
+        expected = list(Post.objects.filter(
+            author__following__user=self.user))
+        self.assertEqual(self.get_page(1) + self.get_page(2), expected)
+        self.assertFalse(FeedEntry.objects.exists())
+
+    def test_new_post_appears_in_merged_feed(self):
+        '''Новый пост автора сразу попадает в pull-ленту'''
+        self.get_page()
+        post = Post.objects.create(
+            text='new', author=User.objects.get(username='Author0'))
+        self.assertEqual(self.get_page()[0], post)
+
+    def test_cold_timelines_load_in_one_query(self):
+        '''Ленты авторов без кеша читаются одним запросом на пачку'''
+        author_ids = list(Follow.objects.filter(
+            user=self.user).values_list('author_id', flat=True))
+        with self.assertNumQueries(1):
+            timelines = author_timelines(author_ids)
+        expected = sorted(
+            (post.pub_date.timestamp(), post.pk)
+            for post in Post.objects.filter(author_id__in=author_ids))
+        self.assertEqual(sorted(sum(timelines, [])), expected)
+
+    def test_warm_timelines_do_not_write_cache(self):
+        '''Если все ленты в кеше, set_many не вызывается'''
+        author_ids = list(Follow.objects.filter(
+            user=self.user).values_list('author_id', flat=True))
+        author_timelines(author_ids)
+        with mock.patch.object(feeds, 'cache') as fake_cache:
+            fake_cache.get_many.return_value = cache.get_many([
+                feeds.AUTHOR_TIMELINE_KEY.format(author_id)
+                for author_id in author_ids])
+            with self.assertNumQueries(0):
+                author_timelines(author_ids)
+        fake_cache.set_many.assert_not_called()
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='User')
+        cls.post = Post.objects.create(
+            text='Пишу про <b>котиков</b> и кошек', author=cls.user)
+        Post.objects.create(text='Про собак', author=cls.user)
+        for i in range(PAGES_NUM):
+            Post.objects.create(text=f'кошка номер {i}', author=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def search(self, query, **params):
+        return self.client.get(
+            reverse('posts:search'), {'q': query, **params})
+
+    def test_search_finds_by_prefix_and_highlights(self):
+        '''Поиск находит пост по началу слова и подсвечивает его'''
+        response = self.search('котик')
+        self.assertTemplateUsed(response, 'posts/search.html')
+        self.assertEqual(list(response.context['page_obj']), [self.post])
+        self.assertContains(response, '<mark>котиков</mark>')
+        self.assertContains(response, '&lt;b&gt;')
+
+    def test_search_is_paginated_and_keeps_query(self):
+        '''Результаты делятся на страницы, ссылки сохраняют запрос'''
+        response = self.search('кошка')
+        self.assertEqual(
+            response.context['page_obj'].paginator.count, PAGES_NUM)
+        self.assertEqual(len(response.context['page_obj']), NUM)
+        self.assertContains(
+            response, 'q=%D0%BA%D0%BE%D1%88%D0%BA%D0%B0&amp;page=2')
+        second = self.search('кошка', page=2)
+        self.assertEqual(len(second.context['page_obj']), PAGES_NUM - NUM)
+
+    def test_index_follows_edit_and_delete(self):
+        '''Индекс обновляется при правке и удалении поста'''
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Теперь про попугаев'
+        post.save()
+        self.assertFalse(self.search('котик').context['page_obj'])
+        self.assertEqual(
+            list(self.search('попугаев').context['page_obj']), [post])
+        post.delete()
+        self.assertFalse(self.search('попугаев').context['page_obj'])
+
+    def test_query_syntax_is_not_interpreted(self):
+        '''Операторы FTS5 в запросе не ломают поиск'''
+        response = self.search('"кош* OR NEAR(')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.search('').context['page_obj'])
+
+    def test_admin_search_uses_index(self):
+        '''Поиск в админке идёт по полнотекстовому индексу'''
+        admin = User.objects.create_superuser('admin', 'a@a.ru', 'pass')
+        self.client.force_login(admin)
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'котик'})
+        self.assertEqual(
+            list(response.context['cl'].result_list), [self.post])
+
+
+class PostAdminTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser('admin', 'a@a.ru', 'pass')
+        cls.group = Group.objects.create(
+            title='Тестовая группа', slug='test-slug', description='-')
+        Post.objects.create(text='Тестовый пост', author=cls.admin,
+                            group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.admin)
+
+    def count_queries(self):
+        address = reverse('admin:posts_post_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(address)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_query_count_is_constant(self):
+        '''Число запросов списка постов не зависит от числа строк'''
+        before = self.count_queries()
+        for i in range(NUM):
+            Post.objects.create(
+                text=f'text{i}',
+                author=User.objects.create_user(username=f'user{i}'),
+                group=Group.objects.create(
+                    title=f'Группа {i}', slug=f'group-{i}', description='-'),
+            )
+        cache.clear()
+        self.assertEqual(self.count_queries(), before)
+
+    def test_group_select_lists_only_selected_group(self):
+        '''Поле группы в строке не перечисляет все группы'''
+        Group.objects.create(title='Другая группа', slug='other',
+                             description='-')
+        response = self.client.get(reverse('admin:posts_post_changelist'))
+        self.assertContains(response, 'admin-autocomplete')
+        self.assertNotContains(response, 'Другая группа')
+
+
+class ExportTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа', slug='test-slug', description='-')
+        cls.post = Post.objects.create(
+            text='Пост в группе', author=cls.user, group=cls.group)
+        Post.objects.create(text='Пост без группы', author=cls.user)
+        Comment.objects.create(post=cls.post, author=cls.user, text='Ответ')
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def export(self, **params):
+        response = self.authorized_client.get(reverse('posts:export'), params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_requires_login(self):
+        '''Выгрузка доступна только авторизованным'''
+        response = Client().get(reverse('posts:export'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_export_group_as_jsonl(self):
+        '''JSONL-выгрузка группы содержит посты с комментариями'''
+        lines = self.export(group=self.group.slug).splitlines()
+        self.assertEqual(len(lines), 1)
+        record = json.loads(lines[0])
+        self.assertEqual(record['text'], self.post.text)
+        self.assertEqual(record['comments'][0]['text'], 'Ответ')
+
+    def test_export_author_as_csv(self):
+        '''CSV-выгрузка автора: строки постов и комментариев'''
+        rows = list(csv.DictReader(io.StringIO(
+            self.export(author=self.user.username, format='csv'))))
+        self.assertEqual(
+            [row['kind'] for row in rows], ['post', 'comment', 'post'])
+
+    def test_comments_are_streamed_in_post_order(self):
+        '''Комментарии порции читаются курсором по (post_id, created)'''
+        other = Post.objects.get(text='Пост без группы')
+        for i in range(3):
+            Comment.objects.create(post=other, author=self.user, text=i)
+        with mock.patch.object(
+                QuerySet, 'iterator', autospec=True,
+                side_effect=QuerySet.iterator) as iterator:
+            with CaptureQueriesContext(connection) as queries:
+                pairs = [
+                    (post, [comment.text for comment in comments])
+                    for post, comments in posts_with_comments(
+                        export_posts(), chunk_size=1)
+                ]
+        self.assertEqual(pairs, [
+            (self.post, ['Ответ']), (other, ['0', '1', '2'])])
+        streamed = [call[0][0].model for call in iterator.call_args_list]
+        self.assertEqual(streamed.count(Comment), 2)
+        comment_queries = [query['sql'] for query in queries.captured_queries
+                           if 'posts_comment' in query['sql']]
+        self.assertEqual(len(comment_queries), 2)
+        for sql in comment_queries:
+            self.assertIn(
+                'ORDER BY "posts_comment"."post_id" ASC, '
+                '"posts_comment"."created" ASC', sql)
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа', slug='test-slug', description='-')
+        cls.post = Post.objects.create(
+            text='Тестовый пост', author=cls.user, group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        self.addresses = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        ]
+
+    def test_unchanged_pages_answer_not_modified(self):
+        '''Неизменившиеся страницы отвечают 304 без запросов страницы'''
+        for address in self.addresses:
+            with self.subTest(address=address):
+                etag = self.client.get(address)['ETag']
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(
+                        address, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertLessEqual(len(queries), 1)
+
+    def test_new_comment_changes_post_etag(self):
+        '''Новый комментарий меняет ETag страницы поста'''
+        address = reverse(
+            'posts:post_detail', kwargs={'post_id': self.post.pk})
+        etag = self.client.get(address)['ETag']
+        Comment.objects.create(post=self.post, author=self.user, text='-')
+        response = self.client.get(address, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_new_post_changes_feed_etags(self):
+        '''Новый пост меняет ETag лент, в которые он попал'''
+        etags = {address: self.client.get(address)['ETag']
+                 for address in self.addresses[:3]}
+        Post.objects.create(text='Ещё пост', author=self.user,
+                            group=self.group)
+        for address, etag in etags.items():
+            with self.subTest(address=address):
+                response = self.client.get(address, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+
+    def test_renames_change_etags(self):
+        '''Смена названия группы и имён авторов меняет ETag страниц'''
+        commenter = User.objects.create_user(username='commenter')
+        Comment.objects.create(post=self.post, author=commenter, text='-')
+        detail, index = self.addresses[3], self.addresses[0]
+        renames = (
+            (detail, self.group, 'title', 'Новое название'),
+            (detail, commenter, 'username', 'renamed'),
+            (index, self.user, 'first_name', 'Новое'),
+        )
+        for address, obj, field, value in renames:
+            with self.subTest(address=address, field=field):
+                etag = self.client.get(address)['ETag']
+                setattr(obj, field, value)
+                obj.save()
+                response = self.client.get(address, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, value)
+
+    def test_etag_depends_on_user(self):
+        '''Гость и авторизованный пользователь получают разные ETag'''
+        address = self.addresses[0]
+        self.assertNotEqual(
+            self.client.get(address)['ETag'],
+            self.authorized_client.get(address)['ETag'])
+
+    def test_relogin_gets_fresh_csrf_token(self):
+        '''После повторного входа форма комментария не приходит из 304'''
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        address = self.addresses[3]
+        etag = client.get(address)['ETag']
+        client.logout()
+        client.force_login(self.user)
+        response = client.get(address, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        client.post(
+            reverse('posts:add_comment', kwargs={'post_id': self.post.pk}),
+            {'text': 'После входа',
+             'csrfmiddlewaretoken': response.context['csrf_token']})
+        self.assertTrue(
+            Comment.objects.filter(text='После входа').exists())
+
+    def test_if_modified_since(self):
+        '''Last-Modified отдаётся после изменения ленты и проверяется'''
+        Post.objects.create(text='Ещё пост', author=self.user)
+        response = self.client.get(self.addresses[0])
+        response = self.client.get(
+            self.addresses[0],
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+
+class AnonymousPageCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа', slug='test-slug', description='-')
+        cls.other_group = Group.objects.create(
+            title='Другая группа', slug='other', description='-')
+        cls.post = Post.objects.create(
+            text='Тестовый пост', author=cls.user, group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+        self.index = reverse('posts:index')
+        self.detail = reverse(
+            'posts:post_detail', kwargs={'post_id': self.post.pk})
+
+    def is_cached(self, address, client=None):
+        client = client or self.client
+        return not client.get(address).templates
+
+    def test_second_anonymous_request_is_served_from_cache(self):
+        '''Повторный запрос гостя не рендерит страницу заново'''
+        for address in (self.index, self.detail):
+            with self.subTest(address=address):
+                self.client.get(address)
+                self.assertTrue(self.is_cached(address))
+
+    def test_authorized_requests_are_not_cached(self):
+        '''Страницы авторизованных пользователей не кешируются целиком'''
+        client = Client()
+        client.force_login(self.user)
+        client.get(self.index)
+        self.assertFalse(self.is_cached(self.index, client))
+
+    def test_saves_purge_tagged_pages_only(self):
+        '''Сохранение группы сбрасывает только страницы с её постами'''
+        self.client.get(self.index)
+        self.client.get(self.detail)
+        self.other_group.title = 'Новое название'
+        self.other_group.save()
+        self.assertTrue(self.is_cached(self.index))
+        self.group.title = 'Новое название'
+        self.group.save()
+        self.assertFalse(self.is_cached(self.index))
+        self.assertContains(self.client.get(self.detail), 'Новое название')
+
+    def test_author_rename_reaches_cached_pages(self):
+        '''После смены имени автора гость и пользователь видят новое имя'''
+        client = Client()
+        client.force_login(self.user)
+        for address in (self.index, self.detail):
+            self.client.get(address)
+            client.get(address)
+        self.user.first_name = 'Новое'
+        self.user.last_name = 'Имя'
+        self.user.save()
+        for address in (self.index, self.detail):
+            for reader in (self.client, client):
+                with self.subTest(address=address, reader=reader):
+                    self.assertContains(reader.get(address), 'Новое Имя')
+
+    def test_comment_purges_post_page(self):
+        '''Новый комментарий сбрасывает страницу поста'''
+        self.client.get(self.detail)
+        Comment.objects.create(post=self.post, author=self.user, text='-')
+        response = self.client.get(self.detail)
+        self.assertContains(response, 'Комментариев:  <span >1</span>')
+
+    def test_stale_page_is_served_while_rebuilt(self):
+        '''Пока страницу перестраивает другой запрос, гость получает
+        прежнюю копию без валидаторов'''
+        old = self.client.get(self.index).content
+        Post.objects.create(text='Новый пост', author=self.user)
+        key = PAGE_CACHE_KEY.format(
+            hashlib.md5(self.index.encode()).hexdigest())
+        cache.add(f'{key}:lock', 1)
+        response = self.client.get(self.index)
+        self.assertEqual(response.content, old)
+        self.assertFalse(response.has_header('ETag'))
+        cache.delete(f'{key}:lock')
+        self.assertContains(self.client.get(self.index), 'Новый пост')
@@ -0,0 +1,213 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore
+
+from core import metrics
+from core.utils import LRUCache, bump_feed_generations
+from .feeds import post_feeds, post_page
+from .models import ImageVariant, Post, ThumbnailJob
+
+logger = logging.getLogger(__name__)
+
+# Миниатюра карточки поста: её выводит posts/includes/post_image.html.
+CARD_THUMBNAIL = ('960x339', {'crop': 'center', 'upscale': True})
+# Все размеры, которые шаблоны запрашивают через {% thumbnail %}.
+THUMBNAIL_GEOMETRIES = (CARD_THUMBNAIL,)
+# Ширины адаптивных вариантов карточки и их форматы: WebP для
+# современных браузеров и JPEG как запасной.
+RESPONSIVE_WIDTHS = (480, 960, 1440)
+RESPONSIVE_FORMATS = ('WEBP', 'JPEG')
+CARD_RATIO = 339 / 960
+MAX_ATTEMPTS = 3
+LOCK_TIMEOUT = timedelta(minutes=10)
+LRU_SIZE = 1024
+
+_hot_thumbnails = LRUCache(LRU_SIZE)
+
+
+def enqueue_thumbnails(post):
+    """Ставит картинку в очередь; до готовности шаблоны покажут заглушку."""
+    Post.objects.filter(pk=post.pk).update(thumbnails_ready=False)
+    post.thumbnails_ready = False
+    ThumbnailJob.objects.update_or_create(
+        post=post, defaults={'locked_at': None, 'attempts': 0})
+
+
+def generate_variants(post):
+    """Строит адаптивные варианты картинки и сохраняет их размеры."""
+    options = CARD_THUMBNAIL[1]
+    variants = []
+    for image_format in RESPONSIVE_FORMATS:
+        for width in RESPONSIVE_WIDTHS:
+            height = round(width * CARD_RATIO)
+            thumbnail = get_thumbnail(
+                post.image, f'{width}x{height}',
+                format=image_format, **options)
+            variants.append(ImageVariant(
+                post=post,
+                format=image_format.lower(),
+                width=thumbnail.width or width,
+                height=thumbnail.height or height,
+                name=thumbnail.name,
+            ))
+    with transaction.atomic():
+        ImageVariant.objects.filter(post=post).delete()
+        ImageVariant.objects.bulk_create(variants)
+
+
+def generate_thumbnails(post):
+    for geometry, options in THUMBNAIL_GEOMETRIES:
+        get_thumbnail(post.image, geometry, **options)
+    generate_variants(post)
+
+
+def _mark_ready(post):
+    Post.objects.filter(pk=post.pk).update(thumbnails_ready=True)
+    bump_feed_generations(post_feeds(post) + [post_page(post.pk)])
+
+
+def _unclaimed(now):
+    """Задания, которые никто не держит или чья блокировка истекла."""
+    return Q(locked_at__isnull=True) | Q(locked_at__lt=now - LOCK_TIMEOUT)
+
+
+def _claim(job):
+    """Забирает задание атомарным UPDATE: обработчиков может быть несколько."""
+    now = timezone.now()
+    claimed = ThumbnailJob.objects.filter(
+        _unclaimed(now), pk=job.pk,
+    ).update(locked_at=now, attempts=job.attempts + 1) == 1
+    if claimed:
+        job.locked_at, job.attempts = now, job.attempts + 1
+    return claimed
+
+
+def _still_claimed(job):
+    """Задание, если его не сбросили после того, как мы его взяли."""
+    return ThumbnailJob.objects.filter(
+        pk=job.pk, locked_at=job.locked_at, attempts=job.attempts)
+
+
+def process_job(job):
+    """Готовит миниатюры; возвращает True, если задание снято с очереди.
+
+    Если картинку поменяли во время работы, enqueue_thumbnails сбросил
+    задание: оно остаётся следующему прогону, а пост не помечается
+    готовым с вариантами старой картинки.
+    """
+    if not _claim(job):
+        return False
+    post = job.post
+    result = 'done'
+    started = time.monotonic()
+    try:
+        if post.image:
+            generate_thumbnails(post)
+    except Exception:
+        logger.exception('Не удалось подготовить миниатюры поста %s', post.pk)
+        if job.attempts < MAX_ATTEMPTS:
+            _still_claimed(job).update(locked_at=None)
+            metrics.inc('yatube_thumbnail_jobs_total', result='retry')
+            return False
+        result = 'failed'
+    # После последней неудачной попытки шаблоны строят миниатюру сами.
+    deleted, _ = _still_claimed(job).delete()
+    if not deleted:
+        metrics.inc('yatube_thumbnail_jobs_total', result='requeued')
+        return False
+    metrics.inc('yatube_thumbnail_jobs_total', result=result)
+    metrics.observe(
+        'yatube_thumbnail_duration_seconds', time.monotonic() - started)
+    _mark_ready(post)
+    return True
+
+
+def process_pending(limit=100):
+    """Разбирает до limit заданий; возвращает число выполненных."""
+    jobs = ThumbnailJob.objects.filter(
+        _unclaimed(timezone.now())).select_related('post').order_by('pk')
+    return sum(process_job(job) for job in jobs[:limit])
+
+
+def thumbnail_file(image, geometry, options):
+    """Файл миниатюры, который построил бы sorl для тех же параметров.
+
+    Повторяет подготовку опций из ThumbnailBackend.get_thumbnail,
+    чтобы имя, а значит и ключ в хранилище sorl, совпадали.
+    """
+    backend = default.backend
+    source = ImageFile(image)
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    name = backend._get_thumbnail_filename(source, geometry, options)
+    return ImageFile(name, default.storage)
+
+
+def _fetch_raw(keys):
+    """Читает записи хранилища sorl: кеш одним get_many, затем
+    отсутствующие в кеше ключи из базы одним запросом."""
+    cached = default.kvstore.cache.get_many(keys)
+    found = {key: value for key, value in cached.items()
+             if isinstance(value, str)}
+    missing = [key for key in keys if key not in cached]
+    if missing:
+        from_db = dict(KVStore.objects.filter(
+            key__in=missing).values_list('key', 'value'))
+        default.kvstore.cache.set_many(
+            from_db, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        found.update(from_db)
+    return found
+
+
+def prefetch_thumbnails(posts, geometry=CARD_THUMBNAIL):
+    """Разрешает миниатюры всех постов страницы пакетно.
+
+    Адаптивные варианты всех постов читаются одним запросом в атрибут
+    variants. Постам без вариантов проставляется атрибут thumbnail:
+    горячие миниатюры берутся из LRU в памяти процесса, остальные -
+    одним чтением хранилища sorl. Не найденные пропускаются: для них
+    шаблон вызовет {% thumbnail %} как обычно.
+    """
+    with_images = [
+        post for post in posts if post.image and post.thumbnails_ready]
+    if not with_images:
+        return
+    variants = {}
+    for variant in ImageVariant.objects.filter(post__in=with_images):
+        variants.setdefault(variant.post_id, []).append(variant)
+    wanted = {}
+    for post in with_images:
+        post.variants = variants.get(post.pk, [])
+        if post.variants:
+            continue
+        thumbnail = thumbnail_file(post.image, *geometry)
+        hot = _hot_thumbnails.get(thumbnail.name)
+        if hot is not None:
+            post.thumbnail = hot
+            continue
+        wanted.setdefault(add_prefix(thumbnail.key), []).append(
+            (post, thumbnail.name))
+    if not wanted or not hasattr(default.kvstore, 'cache'):
+        return
+    for key, value in _fetch_raw(list(wanted)).items():
+        image_file = deserialize_image_file(value)
+        for post, name in wanted[key]:
+            post.thumbnail = image_file
+            _hot_thumbnails.set(name, image_file)
@@ -13,6 +13,10 @@ urlpatterns = [
     path('posts/<int:post_id>/edit/', views.post_edit, name='post_edit'),
     path('posts/<int:post_id>/comment/', views.add_comment,
          name='add_comment'),
+    path('posts/<int:post_id>/comments/', views.post_comments_fragment,
+         name='comments'),
+    path('search/', views.search, name='search'),
+    path('export/', views.export, name='export'),
     path('follow/', views.follow_index, name='follow_index'),
     path('profile/<str:username>/follow/',
          views.profile_follow,
@@ -1,66 +1,160 @@
+from django.http import StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.urls import reverse
+from django.conf import settings
+from django.utils.http import urlencode
 
-from .models import Post, Group, User, Follow
+from .models import Post, Group, User, Follow, UserStats
 from .forms import PostForm, CommentForm
+from .feeds import (FOLLOW_CURSOR_FIELD, INDEX_FEED, author_feed, feed_posts,
+                    follow_feed, follow_feed_posts, group_feed,
+                    post_comments, post_page, post_tags, post_with_comments,
+                    pull_follow_feed)
+from .search import search_posts
+from .export import (CONTENT_TYPES, EXPORT_FORMATS, export_lines,
+                     export_posts)
 
-from core.utils import page_division
+from core.db_router import pin_to_primary, read_from_replica
+from core.utils import (CURSOR_PARAM, CursorPaginator, add_page_tags,
+                        cache_anonymous_page, conditional_feed,
+                        page_division)
 from posts import constants
 
 num = constants.POSTS_LIMIT_P_PAGE
 
 
+def index_feeds(request):
+    return [INDEX_FEED]
+
+
+def group_feeds(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True).first()
+    return None if group_id is None else [group_feed(group_id)]
+
+
+def profile_feeds(request, username):
+    author_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True).first()
+    return None if author_id is None else [author_feed(author_id)]
+
+
+def post_detail_feeds(request, post_id):
+    """Ленты страницы поста: сам пост, автор, группа и комментаторы.
+
+    Всё читается одним запросом, чтобы 304 не стоил больше одного.
+    """
+    rows = list(Post.objects.filter(pk=post_id).order_by().values_list(
+        'author_id', 'group_id', 'comments__author_id').distinct())
+    if not rows:
+        return None
+    author_id, group_id, _ = rows[0]
+    feeds = [post_page(post_id), author_feed(author_id)]
+    if group_id is not None:
+        feeds.append(group_feed(group_id))
+    commenters = {commenter for _, _, commenter in rows
+                  if commenter is not None and commenter != author_id}
+    feeds += [author_feed(commenter) for commenter in sorted(commenters)]
+    return feeds
+
+
+def tag_feed_page(request, context):
+    """Отмечает авторов и группы постов страницы для кеша гостей."""
+    if not request.user.is_authenticated:
+        add_page_tags(request, post_tags(context['page_obj']))
+
+
+@read_from_replica
+@conditional_feed(index_feeds)
+@cache_anonymous_page(index_feeds)
 def index(request):
-    post_list = Post.objects.all()
-    context = page_division(post_list, request, num)
+    post_list = feed_posts()
+    context = page_division(post_list, request, num, INDEX_FEED)
+    tag_feed_page(request, context)
     return render(request, 'posts/index.html', context)
 
 
+@read_from_replica
+@conditional_feed(group_feeds)
+@cache_anonymous_page(group_feeds)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
+    post_list = feed_posts(group=group)
     context = {
         'group': group,
     }
-    context.update(page_division(post_list, request, num))
+    context.update(
+        page_division(post_list, request, num, group_feed(group.pk)))
+    tag_feed_page(request, context)
     return render(request, 'posts/group_list.html', context)
 
 
+@read_from_replica
+@conditional_feed(profile_feeds)
+@cache_anonymous_page(profile_feeds)
 def profile(request, username):
     author = get_object_or_404(User, username=username)
-    post_list = Post.objects.filter(author=author)
+    post_list = feed_posts(author=author)
     context = {
         'author': author,
+        'author_stats': UserStats.for_user(author),
     }
     if request.user.is_authenticated:
-        follow = Follow.objects.filter(user=request.user, author=author)
-        if follow:
-            following = True
-        else:
-            following = False
-        context = {
-            'author': author,
-            'following': following,
-        }
-    
-    context.update(page_division(post_list, request, num))
+        context['following'] = Follow.objects.filter(
+            user=request.user, author=author).exists()
+    context.update(
+        page_division(post_list, request, num, author_feed(author.pk)))
+    tag_feed_page(request, context)
     return render(request, 'posts/profile.html', context)
 
 
+def comments_page(request, comments):
+    """Очередная порция комментариев по курсору (created, id)."""
+    paginator = CursorPaginator(
+        comments, constants.COMMENTS_LIMIT_P_PAGE,
+        date_field='created', descending=False)
+    return paginator.get_cursor_page(request.GET.get(CURSOR_PARAM))
+
+
+@read_from_replica
+@conditional_feed(post_detail_feeds)
+@cache_anonymous_page(post_detail_feeds)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    comments = post.comments.all()
+    post, comments = post_with_comments(post_id)
     form = CommentForm()
     context = {
         'post': post,
-        'comments': comments,
+        'author_stats': UserStats.for_user(post.author),
+        'comments': comments_page(request, comments),
         'form': form,
     }
+    add_page_tags(request, post_tags([post, *context['comments']]))
     return render(request, 'posts/post_detail.html', context)
 
 
+@read_from_replica
+def post_comments_fragment(request, post_id):
+    get_object_or_404(Post.objects.only('pk'), id=post_id)
+    context = {
+        'post_id': post_id,
+        'comments': comments_page(request, post_comments(post_id)),
+    }
+    return render(request, 'posts/includes/comments.html', context)
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    context = {
+        'query': query,
+        'page_query': urlencode({'q': query}) + '&',
+    }
+    context.update(page_division(search_posts(query), request, num))
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
+@pin_to_primary
 def post_create(request):
     form = PostForm(request.POST or None,
                     files=request.FILES or None)
@@ -73,6 +167,7 @@ def post_create(request):
 
 
 @login_required
+@pin_to_primary
 def post_edit(request, post_id):
     is_edit = True
     post = get_object_or_404(Post, id=post_id)
@@ -94,6 +189,7 @@ def post_edit(request, post_id):
 
 
 @login_required
+@pin_to_primary
 def add_comment(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     form = CommentForm(request.POST or None)
@@ -106,17 +202,43 @@ def add_comment(request, post_id):
 
 
 @login_required
+def export(request):
+    """Потоковая выгрузка постов автора или группы с комментариями."""
+    export_format = request.GET.get('format', 'jsonl')
+    if export_format not in EXPORT_FORMATS:
+        export_format = 'jsonl'
+    author = group = None
+    if request.GET.get('author'):
+        author = get_object_or_404(User, username=request.GET['author'])
+    if request.GET.get('group'):
+        group = get_object_or_404(Group, slug=request.GET['group'])
+    response = StreamingHttpResponse(
+        export_lines(export_posts(author, group), export_format),
+        content_type=CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = (
+        f'attachment; filename="posts.{export_format}"')
+    return response
+
+
+@login_required
+@read_from_replica
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    context = page_division(post_list, request, num)
+    if settings.FOLLOW_FEED_ENGINE == 'pull':
+        context = page_division(pull_follow_feed(request.user), request, num)
+    else:
+        post_list = follow_feed_posts(request.user)
+        context = page_division(
+            post_list, request, num, follow_feed(request.user.pk),
+            cursor_field=FOLLOW_CURSOR_FIELD)
     return render(request, 'posts/follow.html', context)
 
 
 @login_required
+@pin_to_primary
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if author != request.user:
-        Follow.objects.create(
+        Follow.objects.get_or_create(
             user=request.user,
             author=author,
         )
@@ -124,6 +246,7 @@ def profile_follow(request, username):
 
 
 @login_required
+@pin_to_primary
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     Follow.objects.filter(
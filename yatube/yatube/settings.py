@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import sys
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -50,6 +51,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,7 +65,7 @@ ROOT_URLCONF = 'yatube.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.templates.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -91,6 +93,45 @@ DATABASES = {
     }
 }
 
+# Реплики для чтения лент: пути к копиям базы SQLite через запятую
+# в YATUBE_DB_REPLICAS (их обновляет команда sync_replicas). В тестах
+# реплики отражают default.
+for number, path in enumerate(
+        filter(None, os.environ.get('YATUBE_DB_REPLICAS', '').split(',')),
+        start=1):
+    DATABASES[f'replica{number}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['core.db_router.ReplicaRouter']
+# Сколько секунд после записи пользователь читает с primary.
+REPLICA_PIN_SECONDS = 5
+# Через сколько секунд снова пробовать недоступную реплику.
+REPLICA_RETRY_SECONDS = 30
+# Кеш, построенный по данным реплики, живёт не дольше её отставания.
+REPLICA_CACHE_TIMEOUT = 60
+
+# Профиль запуска из YATUBE_PROFILE: 'development' или 'production'.
+# В production соединение с default живёт между запросами, а SQLite
+# работает в WAL: читатели не ждут писателя, писатель ждёт блокировку
+# busy_timeout мс вместо немедленной ошибки. Соединения с репликами
+# не сохраняются, чтобы видеть файл, подменённый sync_replicas.
+YATUBE_PROFILE = os.environ.get('YATUBE_PROFILE', 'development')
+SQLITE_PRODUCTION_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+}
+SQLITE_PRAGMAS = {}
+if YATUBE_PROFILE == 'production':
+    SQLITE_PRAGMAS = SQLITE_PRODUCTION_PRAGMAS
+    DATABASES['default']['CONN_MAX_AGE'] = 600
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -142,8 +183,102 @@ EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
+# Двухуровневый кеш: LRU в памяти каждого процесса поверх общего
+# для всех процессов файла SQLite. Тесты не должны видеть данные
+# прошлых запусков, поэтому для них общий уровень живёт в памяти.
+TESTING = 'test' in sys.argv or 'pytest' in sys.modules
 CACHES = {
     'default': {
+        'BACKEND': 'core.cache.TwoTierCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 30,
+            'STAMP_INTERVAL': 1,
+            'STAMP_BUCKETS': 64,
+        },
+    },
+    'shared': {
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+if TESTING:
+    CACHES['shared'] = {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
+
+# Инструментирование запросов (core.middleware.RequestStatsMiddleware):
+# запросы дольше SLOW_REQUEST_MS попадают в лог, а в тестах view,
+# выполнившая больше запросов к БД, чем её бюджет, падает.
+SLOW_REQUEST_MS = 500
+QUERY_BUDGETS = {
+    'posts:index': 6,
+    'posts:group_list': 8,
+    'posts:profile': 9,
+    'posts:post_detail': 8,
+    'posts:comments': 4,
+    'posts:follow_index': 10,
+    'posts:search': 5,
 }
+QUERY_BUDGET_STRICT = TESTING
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.middleware': {'handlers': ['console'], 'level': 'WARNING'},
+    },
+}
+
+# Метрики для Prometheus (/metrics): процессы складывают приращения
+# в общий файл SQLite не чаще раза в METRICS_FLUSH_INTERVAL секунд.
+METRICS_PATH = os.path.join(BASE_DIR, 'metrics.sqlite3')
+if TESTING:
+    METRICS_PATH = ':memory:'
+METRICS_FLUSH_INTERVAL = 1
+METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')
+# Адреса обратных прокси. Для их запросов адрес клиента берётся
+# из X-Forwarded-For, иначе за прокси на этой машине /metrics был бы
+# открыт всем.
+METRICS_TRUSTED_PROXIES = tuple(filter(
+    None, os.environ.get('YATUBE_TRUSTED_PROXIES', '').split(',')))
+# Токен для сборщика метрик: заголовок Authorization: Bearer <токен>.
+METRICS_TOKEN = os.environ.get('YATUBE_METRICS_TOKEN', '')
+
+# Режим постраничного вывода лент: 'offset' (номера страниц)
+# или 'keyset' (курсоры по pub_date и id без OFFSET).
+FEED_PAGINATION = 'offset'
+
+# Подсчёт постов для пагинатора: 'exact', 'cached' или 'estimated'.
+FEED_COUNT_STRATEGY = 'cached'
+FEED_COUNT_CAP = 10000
+FEED_COUNT_TIMEOUT = 60 * 60
+
+# Фрагменты лент сбрасываются сменой поколения, поэтому TTL может быть долгим.
+FEED_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Сколько последних постов автора попадает в ленту при подписке.
+FOLLOW_FEED_BACKFILL = 1000
+
+# Движок ленты подписок: 'push' - материализованная таблица FeedEntry,
+# 'pull' - слияние кешированных лент авторов при чтении. При переходе
+# с 'pull' на 'push' таблицу FeedEntry нужно заполнить заново.
+FOLLOW_FEED_ENGINE = 'push'
+AUTHOR_TIMELINE_LIMIT = 1000
+
+# Страницы лент и постов для гостей кешируются целиком и сбрасываются
+# по тегам; TTL лишь ограничивает жизнь записи, пропущенной сбросом.
+PAGE_CACHE_TIMEOUT = 60 * 10
+
+# Защита от одновременной перестройки кешированных страниц и фрагментов:
+# сколько держится блокировка, сколько после срока можно отдавать
+# прежнее значение и насколько рано (beta) запись перестраивается.
+CACHE_LOCK_TIMEOUT = 30
+CACHE_STALE_TIMEOUT = 60
+CACHE_EARLY_BETA = 1.0